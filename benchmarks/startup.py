@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" License
+
+    Copyright (C) 2014 YUNOHOST.ORG
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published
+    by the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program; if not, see http://www.gnu.org/licenses
+
+"""
+
+"""
+    Benchmark the moulinette start up with synthetic actions maps
+
+    For each size, an actions map with this number of actions - and the
+    library modules of its namespace - is generated in a temporary
+    directory. Then an action is processed several times, each time in
+    a new process, and the time spent in each phase is measured:
+
+        - imports: import and initialize the moulinette
+        - cache_load: load the actions map (compile and cache it for the
+            first run)
+        - construct_parser: construct the parser for the arguments
+        - parse_args: parse the arguments with the interface parser
+        - extra_parse_args: parse the arguments with extra parameters
+        - dispatch: resolve and call the action function
+        - output: format the result
+
+    The results of the first run - with no cache - are reported apart.
+    They are written as JSON so that they can be compared across commits.
+
+    Usage:
+        python benchmarks/startup.py [-s SIZE [SIZE ...]] [-r REPEAT]
+                                     [-i {cli,api}] [-o OUTPUT]
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+NAMESPACE = 'bench'
+ACTIONS_PER_CATEGORY = 20
+PHASES = ['imports', 'cache_load', 'construct_parser', 'parse_args',
+          'extra_parse_args', 'dispatch', 'output']
+
+
+# Synthetic actions map ------------------------------------------------
+
+def generate(path, size):
+    """Generate an actions map of 'size' actions and its library into
+    the 'path' directory and return the arguments of an action"""
+    categories = max(1, size / ACTIONS_PER_CATEGORY)
+    libdir = os.path.join(path, 'lib', NAMESPACE)
+
+    for d in ['bin', 'data/actionsmap', 'lib/%s/locales' % NAMESPACE]:
+        os.makedirs(os.path.join(path, d))
+    shutil.copytree(os.path.join(basedir, 'locales'),
+                    os.path.join(path, 'locales'))
+    with open(os.path.join(libdir, 'locales', 'en.json'), 'w') as f:
+        f.write(json.dumps({'pattern_name': "Must be alphanumeric"}))
+    open(os.path.join(libdir, '__init__.py'), 'w').close()
+
+    actionsmap = [
+        "_global:",
+        "    configuration:",
+        "        authenticate: false",
+        "        lock: false",
+    ]
+    for c in xrange(categories):
+        cn = 'cat%d' % c
+        actionsmap += [
+            "%s:" % cn,
+            "    category_help: Category %d" % c,
+            "    actions:",
+        ]
+        module = []
+        actions = range(size - c * ACTIONS_PER_CATEGORY
+                        if c == categories - 1 else ACTIONS_PER_CATEGORY)
+        for a in actions:
+            an = 'act%d' % a
+            actionsmap += [
+                "        %s:" % an,
+                "            action_help: Action %d of category %d" % (a, c),
+                "            api: POST /%s/%s" % (cn, an),
+                "            arguments:",
+                "                name:",
+                "                    help: A name",
+                "                    extra:",
+                "                        pattern:",
+                "                            - '^[a-z0-9]+$'",
+                "                            - pattern_name",
+                "                -l:",
+                "                    full: --limit",
+                "                    help: A limit",
+                "                    type: int",
+                "                    default: 10",
+                "                --tags:",
+                "                    help: Some tags",
+                "                    nargs: '*'",
+                "                    extra:",
+                "                        required: true",
+                "                -f:",
+                "                    full: --force",
+                "                    help: A flag",
+                "                    action: store_true",
+            ]
+            module += [
+                "def %s_%s(name, limit, tags, force):" % (cn, an),
+                "    return {'name': name, 'limit': limit, 'tags': tags,",
+                "            'force': force}",
+                "",
+            ]
+        with open(os.path.join(libdir, '%s.py' % cn), 'w') as f:
+            f.write('\n'.join(module))
+
+    with open(os.path.join(path, 'data', 'actionsmap',
+                           '%s.yml' % NAMESPACE), 'w') as f:
+        f.write('\n'.join(actionsmap) + '\n')
+
+    # Process the last action of the middle category
+    middle = categories / 2
+    count = size - middle * ACTIONS_PER_CATEGORY \
+        if middle == categories - 1 else ACTIONS_PER_CATEGORY
+    return ('cat%d' % middle, 'act%d' % (count - 1))
+
+
+# Benchmarked process --------------------------------------------------
+
+def run(path, interface, category, action):
+    """Process an action and return the time spent in each phase"""
+    timings = {}
+    start = time.time()
+
+    def _mark(phase):
+        now = time.time()
+        timings[phase] = now - _mark.last
+        _mark.last = now
+    _mark.last = start
+
+    # -- imports
+    sys.path.insert(0, basedir)
+    sys.argv[0] = os.path.join(path, 'bin', 'moulinette')
+    os.environ['BYPASS_LOCK'] = 'yes'
+
+    import moulinette
+    moulinette.init(_from_source=True, logging_config={
+        'version': 1,
+        'incremental': True,
+        'loggers': {'moulinette': {'level': 'ERROR'}},
+    })
+    from moulinette.actionsmap import ActionsMap
+    from moulinette.utils.serialize import JSONExtendedEncoder
+    if interface == 'api':
+        from moulinette.interfaces.api import ActionsMapParser
+        args = {'name': 'foo', 'limit': '5', 'tags': ['a', 'b']}
+        kwargs = {'route': ('POST', '/%s/%s' % (category, action))}
+    else:
+        from moulinette.interfaces.cli import ActionsMapParser
+        args = [category, action, 'foo', '--limit', '5', '--tags', 'a', 'b']
+        kwargs = {}
+    _mark('imports')
+
+    # -- cache_load
+    amap = ActionsMap(ActionsMapParser, [NAMESPACE])
+    _mark('cache_load')
+
+    # -- construct_parser
+    if interface == 'api':
+        # Routes are registered at start
+        parser = amap.parser
+    else:
+        parser = amap._construct_parser(amap._bundles, args)[0]
+        amap._parser = parser
+    _mark('construct_parser')
+
+    # -- parse_args
+    arguments = vars(parser.parse_args(args, **kwargs))
+    tid = arguments.pop('_tid')
+    _mark('parse_args')
+
+    # -- extra_parse_args
+    arguments = amap.extraparser.parse_args(tid, arguments)
+    _mark('extra_parse_args')
+
+    # -- dispatch
+    ret = amap.functions.get(tid)(**arguments)
+    _mark('dispatch')
+
+    # -- output
+    json.dumps(ret, cls=JSONExtendedEncoder)
+    _mark('output')
+
+    timings['total'] = time.time() - start
+    return timings
+
+
+# Main -----------------------------------------------------------------
+
+def _summarize(values):
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'median': values[len(values) / 2],
+        'max': values[-1],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the moulinette start up with synthetic "
+                    "actions maps")
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000],
+                        help="Number of actions of the actions maps")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="Number of runs for each size, with cache")
+    parser.add_argument('-i', '--interface', choices=['cli', 'api'],
+                        default='cli', help="The interface to benchmark")
+    parser.add_argument('-o', '--output',
+                        help="File to write results to, stdout by default")
+    parser.add_argument('--run', nargs=3, help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.run:
+        # Benchmarked process
+        json.dump(run(opts.run[0], opts.interface, *opts.run[1:]),
+                  sys.stdout)
+        return 0
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=basedir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    report = {
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'interface': opts.interface,
+        'repeat': opts.repeat,
+        'results': [],
+    }
+
+    for size in opts.sizes:
+        path = tempfile.mkdtemp(prefix='moulinette-bench-')
+        try:
+            category, action = generate(path, size)
+            cmd = [sys.executable, os.path.abspath(__file__),
+                   '-i', opts.interface, '--run', path, category, action]
+
+            runs = []
+            for _i in xrange(opts.repeat + 1):
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+                out = proc.communicate()[0]
+                if proc.returncode != 0:
+                    sys.stderr.write("benchmark failed for %d actions\n"
+                                     % size)
+                    return 1
+                runs.append(json.loads(out))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+        result = {
+            'actions': size,
+            'cold': runs[0],
+            'phases': dict([(p, _summarize([r[p] for r in runs[1:]]))
+                            for p in PHASES + ['total']]),
+        }
+        report['results'].append(result)
+        sys.stderr.write("%d actions: %.3fs (cold: %.3fs)\n" % (
+            size, result['phases']['total']['median'], runs[0]['total']))
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,12 +25,20 @@ __credits__ = """
     along with this program; if not, see http://www.gnu.org/licenses
     """
 __all__ = [
-    'init', 'api', 'cli',
+    'init', 'api', 'cli', 'build_cache',
     'init_interface', 'MoulinetteError',
 ]
 
+# Report import times if requested, it must be done first
+from moulinette.utils import importtime
+importtime.enable_from_environ()
+
 from moulinette.core import init_interface, MoulinetteError
 
+"""The environment variable which enables the report of translation
+misses at exit"""
+I18N_STATS_ENV_VARIABLE = 'MOULINETTE_I18N_STATS'
+
 
 ## Package functions
 
@@ -49,7 +57,9 @@ def init(logging_config=None, **kwargs):
     instance. See core.Package for available methods and variables.
 
     """
+    import os
     import sys
+    import atexit
     import __builtin__
     from moulinette.core import (
         Package, Moulinette18n, MoulinetteSignals
@@ -64,6 +74,10 @@ def init(logging_config=None, **kwargs):
     __builtin__.__dict__['msignals'] = MoulinetteSignals()
     __builtin__.__dict__['msettings'] = dict()
 
+    # Report translation misses at exit if requested
+    if os.environ.get(I18N_STATS_ENV_VARIABLE, '') not in ('', '0'):
+        atexit.register(m18n.print_stats)
+
     # Add library directory to python path
     sys.path.insert(0, pkg.libdir)
 
@@ -71,7 +85,9 @@ def init(logging_config=None, **kwargs):
 ## Easy access to interfaces
 
 def api(namespaces, host='localhost', port=80, routes={},
-        use_websocket=True, use_cache=True):
+        use_websocket=True, use_cache=True, preload=False, lock_timeout=30,
+        workers=0, processes=1, max_requests=0, worker_timeout=None,
+        session_ttl=3600, session_maxsize=1000):
     """Web server (API) interface
 
     Run a HTTP server with the moulinette for an API usage.
@@ -85,13 +101,38 @@ def api(namespaces, host='localhost', port=80, routes={},
         - use_websocket -- Serve via WSGI to handle asynchronous responses
         - use_cache -- False if it should parse the actions map file
             instead of using the cached one
+        - preload -- True to import all actions modules at start or a
+            list of modules to import as 'namespace.category'
+        - lock_timeout -- The default time period to wait for the lock of
+            a namespace, None to wait indefinitely
+        - workers -- The number of threads to process actions in, so that
+            blocking ones don't stall the server, or 0 to process them
+            in the request greenlet
+        - processes -- The number of server processes to fork, which
+            accept connections on the same socket
+        - max_requests -- The number of requests after which a server
+            process is replaced, 0 to never replace it
+        - worker_timeout -- The time period after which a server process
+            which is blocked is killed, None to never kill it
+        - session_ttl -- The time period after which an unused session
+            expires, None to never expire
+        - session_maxsize -- The maximum number of sessions kept in
+            memory, None for no limit
 
     """
     try:
         moulinette = init_interface('api',
             kwargs={
                 'routes': routes,
-                'use_websocket': use_websocket
+                'use_websocket': use_websocket,
+                'preload': preload,
+                'lock_timeout': lock_timeout,
+                'workers': workers,
+                'processes': processes,
+                'max_requests': max_requests,
+                'worker_timeout': worker_timeout,
+                'session_ttl': session_ttl,
+                'session_maxsize': session_maxsize,
             },
             actionsmap={
                 'namespaces': namespaces,
@@ -139,3 +180,46 @@ def cli(namespaces, args, use_cache=True, output_as=None, parser_kwargs={}):
         logging.getLogger('moulinette').error(e.strerror)
         return e.errno
     return 0
+
+
+## Easy access to actions map cache
+
+def build_cache(namespaces=None, processes=None):
+    """Actions map cache generation
+
+    Generate the cache of the actions map of each namespace in parallel
+    and log the time spent for each one. Then compile the locales of the
+    moulinette and of the namespaces into a bundle.
+
+    Keyword arguments:
+        - namespaces -- The list of namespaces to use, all by default
+        - processes -- The number of worker processes to use, the number
+            of CPUs by default
+
+    """
+    import errno
+    import logging
+    from moulinette.actionsmap import ActionsMap
+
+    logger = logging.getLogger('moulinette')
+    ret = 0
+
+    results = ActionsMap.build_cache(namespaces, processes)
+    for n, (duration, error) in sorted(results.items()):
+        if error is None:
+            logger.info("cache generated for actions map namespace '%s' "
+                        "in %.3fs", n, duration)
+        else:
+            logger.error("unable to generate cache for actions map "
+                         "namespace '%s': %s", n, error)
+            ret = errno.EINVAL
+
+    try:
+        m18n.build_bundle(sorted(results.keys()))
+    except Exception as e:
+        logger.error("unable to compile locales: %s", e)
+        ret = errno.EINVAL
+    else:
+        logger.info("locales compiled for namespaces: %s",
+                    ', '.join(sorted(results.keys())))
+    return ret
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+
+import moulinette
+
+
+def main(args=None):
+    """Run the moulinette command-line entry point
+
+    Parse the given arguments - or the ones of the command-line - and
+    run the requested command. It is intended to be used with the
+    'python -m moulinette' command.
+
+    Keyword arguments:
+        - args -- A list of argument strings
+
+    Returns:
+        The exit status of the command
+
+    """
+    parser = argparse.ArgumentParser(prog='moulinette')
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help="Log and print debug messages")
+    subparsers = parser.add_subparsers(title="commands")
+
+    # -- build-cache
+    subparser = subparsers.add_parser('build-cache',
+        help="Generate the cache of actions maps and locales")
+    subparser.add_argument('namespaces', nargs='*', metavar='NAMESPACE',
+        help="Namespace to generate the cache for, all by default")
+    subparser.add_argument('-j', '--jobs', type=int, default=None,
+        help="Number of worker processes, the number of CPUs by default")
+    subparser.set_defaults(
+        command=lambda o: moulinette.build_cache(o.namespaces, o.jobs))
+
+    opts = parser.parse_args(args)
+
+    moulinette.init(logging_config={
+        'version': 1,
+        'incremental': True,
+        'loggers': {
+            'moulinette': {
+                'level': 'DEBUG' if opts.debug else 'INFO',
+            },
+        },
+    })
+    return opts.command(opts)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
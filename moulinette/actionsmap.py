@@ -2,13 +2,21 @@
 
 import os
 import re
+import sys
+import json
+import mmap
+import fcntl
 import errno
+import struct
+import hashlib
 import logging
-import yaml
+import threading
 import cPickle as pickle
 from time import time
+from functools import partial
 from collections import OrderedDict
 
+from moulinette import __version__
 from moulinette.core import (MoulinetteError, MoulinetteLock)
 from moulinette.interfaces import (
     BaseActionsMapParser, GLOBAL_SECTION, TO_RETURN_PROP
@@ -48,6 +56,9 @@ class _ExtraParameter(object):
     """A list of interface for which the parameter doesn't apply"""
     skipped_iface = []
 
+    """Either the parameter may interact with the user or not"""
+    interactive = False
+
 
     ## Virtual methods
     # Each extra parameters classes can implement these methods.
@@ -67,6 +78,22 @@ class _ExtraParameter(object):
         """
         return arg_value
 
+    def bind(self, parameter, arg_name):
+        """
+        Bind the parameter to an argument
+
+        Return a callable which parses a value of the argument, or None
+        if the parameter has nothing to do for it. It is called once per
+        argument and the returned callable on each parsing, so that the
+        parameter value can be prepared there.
+
+        Keyword arguments:
+            - parameter -- The value of this parameter for the action
+            - arg_name -- The argument name
+
+        """
+        return partial(self, parameter, arg_name)
+
     @staticmethod
     def validate(value, arg_name):
         """
@@ -92,6 +119,7 @@ class AskParameter(_ExtraParameter):
     """
     name = 'ask'
     skipped_iface = [ 'api' ]
+    interactive = True
 
     def __call__(self, message, arg_name, arg_value):
         if arg_value:
@@ -146,26 +174,32 @@ class PatternParameter(_ExtraParameter):
     name = 'pattern'
 
     def __call__(self, arguments, arg_name, arg_value):
+        return self.bind(arguments, arg_name)(arg_value)
+
+    def bind(self, arguments, arg_name):
         pattern, message = (arguments[0], arguments[1])
+        match = re.compile(pattern, re.UNICODE).match
 
-        # Use temporarly utf-8 encoded value
-        try:
-            v = unicode(arg_value, 'utf-8')
-        except:
-            v = arg_value
+        def parse(arg_value):
+            # Use temporarly utf-8 encoded value
+            try:
+                v = unicode(arg_value, 'utf-8')
+            except:
+                v = arg_value
 
-        if v and not re.match(pattern, v or '', re.UNICODE):
-            logger.debug("argument value '%s' for '%s' doesn't match pattern '%s'",
-                         v, arg_name, pattern)
+            if v and not match(v):
+                logger.debug("argument value '%s' for '%s' doesn't match "
+                             "pattern '%s'", v, arg_name, pattern)
 
-            # Attempt to retrieve message translation
-            msg = m18n.n(message)
-            if msg == message:
-                msg = m18n.g(message)
+                # Attempt to retrieve message translation
+                msg = m18n.n(message)
+                if msg == message:
+                    msg = m18n.g(message)
 
-            raise MoulinetteError(errno.EINVAL, m18n.g('invalid_argument',
-                                        arg_name, msg))
-        return arg_value
+                raise MoulinetteError(errno.EINVAL, m18n.g('invalid_argument',
+                                            arg_name, msg))
+            return arg_value
+        return parse
 
     @staticmethod
     def validate(value, arg_name):
@@ -190,12 +224,16 @@ class RequiredParameter(_ExtraParameter):
 
     def __call__(self, required, arg_name, arg_value):
         if required and (arg_value is None or arg_value == ''):
-            logger.debug("argument '%s' is required",
-                         v, arg_name, pattern)
+            logger.debug("argument '%s' is required", arg_name)
             raise MoulinetteError(errno.EINVAL, m18n.g('argument_required',
                                                        arg_name))
         return arg_value
 
+    def bind(self, required, arg_name):
+        if not required:
+            return None
+        return super(RequiredParameter, self).bind(required, arg_name)
+
     @staticmethod
     def validate(value, arg_name):
         if not isinstance(value, bool):
@@ -213,6 +251,22 @@ extraparameters_list = [ AskParameter, PasswordParameter, RequiredParameter,
 
 # Extra parameters argument Parser
 
+def _unique(values):
+    """Return the list of values without duplicates, keeping order"""
+    seen = set()
+    result = []
+    for v in values:
+        try:
+            if v in seen:
+                continue
+            seen.add(v)
+        except TypeError:
+            # Unhashable value
+            if v in result:
+                continue
+        result.append(v)
+    return result
+
 class ExtraArgumentParser(object):
     """
     Argument validator and parser for the extra parameters.
@@ -225,6 +279,8 @@ class ExtraArgumentParser(object):
         self.iface = iface
         self.extra = OrderedDict()
         self._extra_params = {GLOBAL_SECTION: {}}
+        self._pipelines = {}
+        self._pipelines_lock = threading.Lock()
 
         # Append available extra parameters for the current interface
         for klass in extraparameters_list:
@@ -278,55 +334,525 @@ class ExtraArgumentParser(object):
         except KeyError:
             self._extra_params[tid] = OrderedDict({arg_name: parameters})
 
-    def parse_args(self, tid, args):
+        # Invalidate compiled pipelines which use it
+        if tid == GLOBAL_SECTION:
+            self._pipelines.clear()
+        else:
+            self._pipelines.pop((tid, True), None)
+            self._pipelines.pop((tid, False), None)
+
+    def parse_args(self, tid, args, interactive=True):
         """
         Parse arguments for an action with extra parameters
 
+        Each value of a list argument is parsed and the argument is
+        replaced by the list of resulting values, in the same order and
+        without duplicates.
+
         Keyword arguments:
             - tid -- The tuple identifier of the action
             - args -- A dict of argument name associated to their value
+            - interactive -- False to skip parameters which interact
+                with the user
+
+        """
+        key = (tid, interactive)
+        try:
+            pipeline = self._pipelines[key]
+        except KeyError:
+            # Compile it once if several threads need it
+            with self._pipelines_lock:
+                pipeline = self._pipelines.get(key)
+                if pipeline is None:
+                    pipeline = self._pipelines[key] = \
+                        self._compile(tid, interactive)
+
+        # Iterate over bound extra parameters parsers
+        for arg_name, parser in pipeline:
+            arg_value = args.get(arg_name, None)
+
+            # Parse the argument
+            if isinstance(arg_value, list):
+                arg_value = _unique([parser(v) for v in arg_value])
+            else:
+                arg_value = parser(arg_value)
+
+            # Update argument value
+            if arg_value is not None:
+                args[arg_name] = arg_value
+        return args
+
+    def _compile(self, tid, interactive=True):
+        """
+        Compile the extra parameters of an action
+
+        Return the ordered list of (arg_name, parser) to apply on the
+        arguments of the action, where parser is a callable bound to an
+        extra parameter value and the argument.
 
         """
         extra_args = OrderedDict(self._extra_params.get(GLOBAL_SECTION, {}))
         extra_args.update(self._extra_params.get(tid, {}))
 
-        # Iterate over action arguments with extra parameters
+        pipeline = []
+        parsers = {}
         for arg_name, extra_params in extra_args.items():
             # Iterate over available extra parameters
             for p, cls in self.extra.items():
+                if cls.interactive and not interactive:
+                    continue
                 try:
                     extra_value = extra_params[p]
                 except KeyError:
                     continue
-                arg_value = args.get(arg_name, None)
+                try:
+                    parser = parsers[p]
+                except KeyError:
+                    parser = parsers[p] = cls(self.iface)
+                bound = parser.bind(extra_value, arg_name)
+                if bound is not None:
+                    pipeline.append((arg_name, bound))
+        return pipeline
 
-                # Initialize the extra parser
-                parser = cls(self.iface)
 
-                # Parse the argument
-                if isinstance(arg_value, list):
-                    for v in arg_value:
-                        r = parser(extra_value, arg_name, v)
-                        if r not in arg_value:
-                            arg_value.append(r)
-                else:
-                    arg_value = parser(extra_value, arg_name, arg_value)
+## Compiled actions map ----------------------------------------------
 
-                # Update argument value
-                if arg_value is not None:
-                    args[arg_name] = arg_value
-        return args
+"""The magic string and the format version of a compiled bundle"""
+BUNDLE_MAGIC = 'MAMB'
+BUNDLE_VERSION = 3
 
+# Bundle header: magic, format version, index offset and index length
+_bundle_header = struct.Struct('>4sHQQ')
 
-## Main class ----------------------------------------------------------
+def get_argument_dest(name, full, parameters):
+    """Return the destination of an argument as argparse gives it
+
+    Keyword arguments:
+        - name -- The argument name
+        - full -- The argument's 'full' parameter
+        - parameters -- A dict of the argument parameters
+
+    """
+    if 'dest' in parameters:
+        return parameters['dest']
+    if name[0] != '-':
+        return name
+    return (full or name).lstrip('-').replace('-', '_')
+
+def get_source_key(source):
+    """Return the key identifying an actions map source
+
+    The key is composed by the hash of the actions map file content and
+    the moulinette version, so that a compiled bundle is invalidated if
+    either of them changes.
+
+    Keyword arguments:
+        - source -- The content of the actions map file
+
+    """
+    return (hashlib.sha1(source).hexdigest(), __version__)
+
+def compile_actionsmap(namespace, actionsmap, source_key=None):
+    """Compile an actions map into a bundle
+
+    Normalize and validate the actions map of a namespace and serialize
+    it into a bundle which can be read with ActionsMapBundle. The
+    arguments of each action - with their converted type and validated
+    extra parameters - are stored as a separate record so that they can
+    be loaded only when needed. The records are referenced by an index,
+    which also contains categories and actions parameters and
+    configuration. It is stored at the end of the bundle and pointed by
+    the header.
+
+    Keyword arguments:
+        - namespace -- The actions map namespace
+        - actionsmap -- A multi-level dictionnary of categories/actions/
+            arguments list as loaded from the actions map file
+        - source_key -- The key of the actions map source as returned
+            by get_source_key
+
+    Returns:
+        The compiled bundle as a string
+
+    """
+    extraparser = ExtraArgumentParser(None)
+    chunks = []
+    offset = [_bundle_header.size]
+
+    ## Append a record and return its position
+    def _add_record(record):
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        position = (offset[0], len(data))
+        chunks.append(data)
+        offset[0] += len(data)
+        return position
+
+    ## Normalize arguments as a list of (name, full, parameters, extra)
+    def _compile_arguments(arguments):
+        compiled = []
+        for argn, argp in (arguments or {}).items():
+            argp = dict(argp or {})
+            full = argp.pop('full', None)
+            try: argp['type'] = eval(argp['type'])
+            except: pass
+
+            extra = argp.pop('extra', None)
+            if extra is not None:
+                # Validate with the name argparse would give as destination
+                dest = get_argument_dest(str(argn), full, argp)
+                extra = extraparser.validate(dest, dict(extra))
+            compiled.append((str(argn), full, argp, extra))
+        return compiled
+
+    index = {
+        'namespace': namespace,
+        'source': source_key,
+        'categories': OrderedDict(),
+    }
+
+    # Compile global parameters
+    _global = actionsmap.get('_global', {}) or {}
+    index['global'] = _add_record({
+        'configuration': _global.get('configuration', None),
+        'arguments': _compile_arguments(_global.get('arguments', None)),
+    })
+
+    # Compile categories
+    for cn, cp in actionsmap.items():
+        if cn == '_global':
+            continue
+        cp = dict(cp or {})
+        c_conf = cp.pop('configuration', None)
+        try:
+            actions = cp.pop('actions')
+        except KeyError:
+            # Invalid category without actions
+            logger.warning("no actions found in category '%s' in " \
+                           "namespace '%s'", cn, namespace)
+            continue
+
+        # -- Compile actions
+        c_actions = OrderedDict()
+        for an, ap in actions.items():
+            ap = dict(ap or {})
+            record = _add_record({
+                'arguments': _compile_arguments(ap.pop('arguments', None)),
+            })
+            c_actions[an] = (record, ap, ap.pop('configuration', None))
+        index['categories'][cn] = (cp, c_actions, c_conf)
+
+    # Append the index and prepend the header
+    index_pos = _add_record(index)
+    chunks.insert(0, _bundle_header.pack(BUNDLE_MAGIC, BUNDLE_VERSION,
+                                         *index_pos))
+    return ''.join(chunks)
+
+
+class ActionsMapBundle(object):
+    """Compiled actions map of a namespace
+
+    Provide a read access to the records of an actions map compiled
+    with compile_actionsmap. Only the index is loaded at initialization,
+    the global parameters and the actions are unserialized on demand
+    and kept once loaded.
+
+    Keyword arguments:
+        - buf -- The compiled bundle as a string or a mmap object
+
+    """
+    def __init__(self, buf):
+        try:
+            magic, version, offset, length = \
+                _bundle_header.unpack(buf[:_bundle_header.size])
+        except struct.error:
+            raise ValueError("truncated actions map bundle")
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise ValueError("unsupported actions map bundle")
+
+        self._buf = buf
+        self._index = self._load_record((offset, length))
+        self._global = None
+        self._actions = {}
+        self._records_lock = threading.Lock()
+
+    @classmethod
+    def load(klass, path):
+        """Map a bundle file to memory and return its bundle
+
+        Keyword arguments:
+            - path -- The path to the bundle file
+
+        """
+        with open(path, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # The file is empty or cannot be mapped
+                raise ValueError("unable to map actions map bundle")
+        return klass(buf)
+
+    @property
+    def namespace(self):
+        """Return the namespace of the actions map"""
+        return self._index['namespace']
+
+    @property
+    def source_key(self):
+        """Return the key of the source it has been compiled from"""
+        return self._index.get('source')
+
+    def get_global(self):
+        """Return the global parameters as a dict of 'configuration'
+        and 'arguments'"""
+        if self._global is None:
+            with self._records_lock:
+                if self._global is None:
+                    self._global = self._load_record(self._index['global'])
+        return self._global
+
+    def get_categories(self):
+        """Return a list of (name, parameters) for each category"""
+        return [(cn, dict(c[0]))
+                for cn, c in self._index['categories'].items()]
+
+    def get_category(self, name):
+        """Return the parameters of a category or None"""
+        try:
+            return dict(self._index['categories'][name][0])
+        except KeyError:
+            return None
+
+    def get_actions(self, category):
+        """Return a list of (name, parameters) for each category action"""
+        return [(an, dict(a[1]))
+                for an, a in self._index['categories'][category][1].items()]
+
+    def get_category_conf(self, category):
+        """Return the configuration of a category or None"""
+        return self._index['categories'][category][2]
+
+    def get_action_conf(self, category, action):
+        """Return the configuration of an action or None"""
+        return self._index['categories'][category][1][action][2]
+
+    def get_action(self, category, action):
+        """Return the record of an action
+
+        Load and return the action record as a dict of 'arguments'. A
+        KeyError is raised if the action doesn't exist.
+
+        Keyword arguments:
+            - category -- The category name
+            - action -- The action name
+
+        """
+        key = (category, action)
+        try:
+            return self._actions[key]
+        except KeyError:
+            position = self._index['categories'][category][1][action][0]
+
+        # Load it once if several threads need it
+        with self._records_lock:
+            try:
+                return self._actions[key]
+            except KeyError:
+                record = self._actions[key] = self._load_record(position)
+                return record
+
+    def _load_record(self, (offset, length)):
+        """Unserialize a record from its position"""
+        return pickle.loads(self._buf[offset:offset+length])
+
+
+## Actions functions -------------------------------------------------
+
+class FunctionsRegistry(object):
+    """Registry of the actions functions
+
+    Resolve and keep the function of each action, so that its module is
+    imported only once. The time spent to import each module is
+    recorded. A function is resolved again if its module has been
+    reloaded or removed from sys.modules in the meantime.
+
+    """
+    def __init__(self):
+        self._functions = {}
+        self.import_times = OrderedDict()
+
+    @staticmethod
+    def get_names(tid):
+        """Return the module and function names of an action"""
+        namespace, category, action = tid
+        return ('%s.%s' % (namespace, category),
+                '%s_%s' % (category, action.replace('-', '_')))
+
+    def get(self, tid):
+        """Get the function of an action
+
+        Return the function of the action, importing its module if
+        needed. An ImportError or AttributeError is raised if it cannot
+        be resolved.
+
+        Keyword arguments:
+            - tid -- The tuple identifier of the action
+
+        """
+        try:
+            mod, func_name, func = self._functions[tid]
+        except KeyError:
+            pass
+        else:
+            # Check that the module has not been reloaded
+            if sys.modules.get(mod.__name__) is mod and \
+                    getattr(mod, func_name, None) is func:
+                return func
+            logger.debug("module '%s' has changed, resolving function "
+                         "again", mod.__name__)
+
+        mod_name, func_name = self.get_names(tid)
+        mod = self._import_module(mod_name)
+        func = getattr(mod, func_name)
+        self._functions[tid] = (mod, func_name, func)
+        return func
+
+    def preload(self, tids):
+        """Resolve the functions of the given actions
+
+        Keyword arguments:
+            - tids -- A list of tuple identifier of actions
+
+        """
+        for tid in tids:
+            try:
+                self.get(tid)
+            except (AttributeError, ImportError) as e:
+                logger.warning("unable to preload function %s.%s: %s",
+                               *(self.get_names(tid) + (e,)))
+
+    def invalidate(self, module=None):
+        """Forget resolved functions of a module or of all modules"""
+        for tid, (mod, func_name, func) in self._functions.items():
+            if module is None or mod.__name__ == module:
+                del self._functions[tid]
+
+    def _import_module(self, name):
+        """Import a module if needed and return it"""
+        mod = sys.modules.get(name)
+        if mod is None:
+            start = time()
+            __import__(name, globals=globals(), level=0)
+            mod = sys.modules[name]
+            self.import_times[name] = time() - start
+            logger.debug("module '%s' imported in %.3fs", name,
+                         self.import_times[name])
+        return mod
+
+
+## Actions map loaders -----------------------------------------------
+
+_yaml_loader = None
 
 def ordered_yaml_load(stream):
-    class OrderedLoader(yaml.Loader):
-        pass
-    OrderedLoader.add_constructor(
-        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-        lambda loader, node: OrderedDict(loader.construct_pairs(node)))
-    return yaml.load(stream, OrderedLoader)
+    global _yaml_loader
+
+    # yaml is only imported when an actions map must be compiled
+    import yaml
+    if _yaml_loader is None:
+        # Use the libyaml based loader if available
+        class _OrderedYAMLLoader(getattr(yaml, 'CLoader', yaml.Loader)):
+            pass
+        _OrderedYAMLLoader.add_constructor(
+            yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
+            lambda loader, node: OrderedDict(loader.construct_pairs(node)))
+        _yaml_loader = _OrderedYAMLLoader
+    return yaml.load(stream, _yaml_loader)
+
+
+class _ActionsMapLoader(object):
+    """
+    Loader for an actions map file format.
+
+    It is a pure virtual class that each loader classes must implement.
+
+    """
+
+    ## Required variables
+    # Each loader classes must overwrite these variables.
+
+    """The extension of the actions map file"""
+    extension = None
+
+
+    ## Virtual methods
+    # Each loader classes must implement these methods.
+
+    @staticmethod
+    def load(source):
+        """
+        Load an actions map
+
+        Keyword arguments:
+            - source -- The content of the actions map file
+
+        Returns:
+            A multi-level ordered dictionnary of categories/actions/
+            arguments list
+
+        """
+        raise NotImplementedError("derived class must override this method")
+
+class YAMLLoader(_ActionsMapLoader):
+    """
+    Load an actions map from a YAML file.
+
+    """
+    extension = 'yml'
+
+    @staticmethod
+    def load(source):
+        return ordered_yaml_load(source)
+
+class JSONLoader(_ActionsMapLoader):
+    """
+    Load an actions map from a JSON file.
+
+    As the YAML loader does, strings are returned as str objects if they
+    only contain ASCII characters.
+
+    """
+    extension = 'json'
+
+    @classmethod
+    def load(klass, source):
+        return klass._to_str(json.loads(source, object_pairs_hook=OrderedDict))
+
+    @classmethod
+    def _to_str(klass, value):
+        if isinstance(value, unicode):
+            try:
+                return str(value)
+            except UnicodeEncodeError:
+                return value
+        elif isinstance(value, list):
+            return [klass._to_str(v) for v in value]
+        elif isinstance(value, dict):
+            return OrderedDict([(klass._to_str(k), klass._to_str(v))
+                                for k, v in value.items()])
+        return value
+
+"""
+The list of available loaders classes. The first one for which an actions
+map file exists will be used, so it must be ordered from the fastest.
+
+Note that a compiled actions map - with the 'bundle' extension - will be
+used before any of them if it exists and has been compiled from it.
+
+"""
+actionsmap_loaders = [ JSONLoader, YAMLLoader ]
+
+
+## Main class ----------------------------------------------------------
 
 
 class ActionsMap(object):
@@ -360,35 +886,36 @@ class ActionsMap(object):
 
         if len(namespaces) == 0:
             namespaces = self.get_namespaces()
-        actionsmaps = OrderedDict()
+        bundles = OrderedDict()
 
         # Iterate over actions map namespaces
         for n in namespaces:
             logger.debug("loading actions map namespace '%s'", n)
 
-            if use_cache:
-                try:
-                    # Attempt to load cache
-                    with open('%s/actionsmap/%s.pkl' % (pkg.cachedir, n)) as f:
-                        actionsmaps[n] = pickle.load(f)
-                # TODO: Switch to python3 and catch proper exception
-                except IOError:
-                    self.use_cache = False
-                    actionsmaps = self.generate_cache(namespaces)
-            elif n not in actionsmaps:
-                with open('%s/actionsmap/%s.yml' % (pkg.datadir, n)) as f:
-                    actionsmaps[n] = ordered_yaml_load(f)
+            # Attempt to load the provided compiled actions map
+            bundle = self._load_provided(n)
+            if bundle is None:
+                bundle = self._load_source(n, use_cache)
+            bundles[n] = bundle
 
             # Load translations
             m18n.load_namespace(n)
 
-        # Generate parsers
+        # Parsers are generated when needed
         self.extraparser = ExtraArgumentParser(parser_class.interface)
-        self._parser = self._construct_parser(actionsmaps, **parser_kwargs)
+        self.functions = FunctionsRegistry()
+        self._bundles = bundles
+        self._parser_kwargs = parser_kwargs
+        self._parser = None
+        self._partial_parser = False
+        self._batch_arguments = {}
 
     @property
     def parser(self):
         """Return the instance of the interface's actions map parser"""
+        if self._parser is None or self._partial_parser:
+            self._parser, self._partial_parser = self._construct_parser(
+                self._bundles, **self._parser_kwargs)
         return self._parser
 
     def get_authenticator(self, profile='default'):
@@ -411,19 +938,27 @@ class ActionsMap(object):
         else:
             return auth()
 
-    def process(self, args, timeout=0, **kwargs):
+    def process(self, args, timeout=0, lock_class=MoulinetteLock, **kwargs):
         """
         Parse arguments and process the proper action
 
         Keyword arguments:
             - args -- The arguments to parse
             - timeout -- The time period before failing if the lock
-                cannot be acquired for the action
+                cannot be acquired for the action, unless it is set by
+                the 'lock_timeout' configuration of the action
+            - lock_class -- The MoulinetteLock based class to use to
+                lock the namespace
             - **kwargs -- Additional interface arguments
 
         """
+        # Construct only needed parsers at first
+        if self._parser is None:
+            self._parser, self._partial_parser = self._construct_parser(
+                self._bundles, args, **self._parser_kwargs)
+
         # Parse arguments
-        arguments = vars(self.parser.parse_args(args, **kwargs))
+        arguments = vars(self._parser.parse_args(args, **kwargs))
 
         # Retrieve tid and parse arguments with extra parameters
         tid = arguments.pop('_tid')
@@ -435,38 +970,111 @@ class ActionsMap(object):
 
         # Retrieve action information
         namespace, category, action = tid
-        func_name = '%s_%s' % (category, action.replace('-', '_'))
+        try:
+            func = self.functions.get(tid)
+        except (AttributeError, ImportError):
+            logger.exception("unable to load function %s.%s",
+                             *self.functions.get_names(tid))
+            raise MoulinetteError(errno.EIO, m18n.g('error_see_log'))
 
-        # Lock the moulinette for the namespace
-        with MoulinetteLock(namespace, timeout):
+        # Lock the moulinette for the namespace as configured
+        try:
+            lock_mode = self._parser.get_conf(tid, 'lock')
+        except KeyError:
+            lock_mode = 'exclusive'
+        log_id = start_action_logging()
+        lock = None
+        if lock_mode != 'none':
             try:
-                mod = __import__('%s.%s' % (namespace, category),
-                                 globals=globals(), level=0,
-                                 fromlist=[func_name])
-                func = getattr(mod, func_name)
-            except (AttributeError, ImportError):
-                logger.exception("unable to load function %s.%s.%s",
-                                 namespace, category, func_name)
-                raise MoulinetteError(errno.EIO, m18n.g('error_see_log'))
+                timeout = self._parser.get_conf(tid, 'lock_timeout')
+            except KeyError:
+                pass
+            lock = lock_class(namespace, timeout, action='%s.%s.%s' % tid,
+                              shared=(lock_mode == 'shared'),
+                              action_id=log_id)
+            lock.acquire()
+
+        try:
+            if logger.isEnabledFor(logging.DEBUG):
+                # Log arguments in debug mode only for safety reasons
+                logger.info('processing action [%s]: %s.%s.%s with args=%s',
+                            log_id, namespace, category, action, arguments)
             else:
-                log_id = start_action_logging()
-                if logger.isEnabledFor(logging.DEBUG):
-                    # Log arguments in debug mode only for safety reasons
-                    logger.info('processing action [%s]: %s.%s.%s with args=%s',
-                                log_id, namespace, category, action, arguments)
-                else:
-                    logger.info('processing action [%s]: %s.%s.%s',
-                                log_id, namespace, category, action)
+                logger.info('processing action [%s]: %s.%s.%s',
+                            log_id, namespace, category, action)
 
-                # Load translation and process the action
-                m18n.load_namespace(namespace)
-                start = time()
-                try:
-                    return func(**arguments)
-                finally:
-                    stop = time()
-                    logger.debug('action [%s] ended after %.3fs',
-                                 log_id, stop - start)
+            # Load translation and process the action
+            m18n.load_namespace(namespace)
+            start = time()
+            try:
+                return func(**arguments)
+            finally:
+                stop = time()
+                logger.debug('action [%s] ended after %.3fs',
+                             log_id, stop - start)
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def validate_batch(self, tid, rows):
+        """
+        Validate many sets of arguments for an action
+
+        Each set is a dict of argument destinations associated to their
+        value, as they would be passed to the action function. Values
+        are converted to the argument type, missing ones are set to
+        their default and the extra parameters are applied - except the
+        ones which interact with the user. The action is not processed,
+        so that neither the lock is acquired nor its module imported.
+
+        Keyword arguments:
+            - tid -- The tuple identifier of the action
+            - rows -- An iterable of arguments dict
+
+        Returns:
+            A list of 2-tuple (arguments, error) for each set, where
+            error is either None or a MoulinetteError if the set is
+            invalid
+
+        """
+        try:
+            arguments = self._batch_arguments[tid]
+        except KeyError:
+            arguments = self._batch_arguments[tid] = \
+                self._get_batch_arguments(tid)
+
+        results = []
+        for row in rows:
+            try:
+                values = self._coerce_arguments(arguments, row)
+                values = self.extraparser.parse_args(tid, values,
+                                                     interactive=False)
+            except MoulinetteError as e:
+                results.append((None, e))
+            else:
+                results.append((values, None))
+        return results
+
+    def preload_functions(self, modules=None):
+        """
+        Import modules and resolve functions of the actions
+
+        Keyword arguments:
+            - modules -- A list of modules to preload as
+                'namespace.category' or None for all of them
+
+        Returns:
+            A dict of the import time of each imported module
+
+        """
+        tids = []
+        for n, bundle in self._bundles.items():
+            for cn, cp in bundle.get_categories():
+                if modules is None or '%s.%s' % (n, cn) in modules:
+                    tids.extend([(n, cn, an)
+                                 for an, ap in bundle.get_actions(cn)])
+        self.functions.preload(tids)
+        return self.functions.import_times
 
     @staticmethod
     def get_namespaces():
@@ -478,10 +1086,12 @@ class ActionsMap(object):
 
         """
         namespaces = []
+        extensions = ['bundle'] + [l.extension for l in actionsmap_loaders]
 
         for f in os.listdir('%s/actionsmap' % pkg.datadir):
-            if f.endswith('.yml'):
-                namespaces.append(f[:-4])
+            n, _sep, ext = f.rpartition('.')
+            if n and ext in extensions and n not in namespaces:
+                namespaces.append(n)
         return namespaces
 
     @classmethod
@@ -489,87 +1099,389 @@ class ActionsMap(object):
         """
         Generate cache for the actions map's file(s)
 
+        Compile the actions map of each namespace and write the resulting
+        bundle into the cache directory.
+
         Keyword arguments:
             - namespaces -- A list of namespaces to generate cache for
 
         Returns:
-            A dict of actions map for each namespaces
+            A dict of ActionsMapBundle for each namespaces
 
         """
-        actionsmaps = {}
+        bundles = {}
         if not namespaces:
             namespaces = klass.get_namespaces()
 
         # Iterate over actions map namespaces
         for n in namespaces:
-            logger.debug("generating cache for actions map namespace '%s'", n)
+            loader, source = klass._read_source(n)
+            bundles[n] = klass._generate_cache(n, source, loader)
 
-            # Read actions map from yaml file
-            am_file = '%s/actionsmap/%s.yml' % (pkg.datadir, n)
-            with open(am_file, 'r') as f:
-                actionsmaps[n] = yaml.load(f)
+        return bundles
 
-            # Cache actions map into pickle file
-            with pkg.open_cachefile('%s.pkl' % n, 'w', subdir='actionsmap') as f:
-                pickle.dump(actionsmaps[n], f)
+    @classmethod
+    def build_cache(klass, namespaces=None, processes=None):
+        """
+        Generate cache for the actions map's file(s) in parallel
 
-        return actionsmaps
+        Generate cache for each namespace in a pool of worker processes
+        and return the time spent and the error - if any - for each one.
+
+        Keyword arguments:
+            - namespaces -- A list of namespaces to generate cache for
+            - processes -- The number of worker processes to use, the
+                number of CPUs by default
+
+        Returns:
+            A dict of (duration, error) for each namespaces where error
+            is None if the cache has been generated
+
+        """
+        if not namespaces:
+            namespaces = klass.get_namespaces()
+
+        if processes == 1 or len(namespaces) == 1:
+            results = map(_build_cache_worker, namespaces)
+        else:
+            from multiprocessing import Pool
+
+            pool = Pool(processes)
+            try:
+                results = pool.map(_build_cache_worker, namespaces)
+            finally:
+                pool.close()
+                pool.join()
+
+        return dict([(n, (d, e)) for n, d, e in results])
 
 
     ## Private methods
 
-    def _construct_parser(self, actionsmaps, **kwargs):
+    @staticmethod
+    def _read_source(namespace):
+        """
+        Read the actions map file of a namespace
+
+        Look for the actions map file of the first available loader
+        and read it.
+
+        Keyword arguments:
+            - namespace -- The actions map namespace
+
+        Returns:
+            A 2-tuple of the loader class and the file content
+
+        """
+        for loader in actionsmap_loaders:
+            try:
+                with open('%s/actionsmap/%s.%s' % \
+                              (pkg.datadir, namespace, loader.extension)) as f:
+                    return (loader, f.read())
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        raise IOError(errno.ENOENT, "no actions map file found for "
+                      "namespace '%s'" % namespace)
+
+    @classmethod
+    def _load_source(klass, namespace, use_cache=True):
+        """
+        Load and compile the actions map file of a namespace
+
+        Keyword arguments:
+            - namespace -- The actions map namespace
+            - use_cache -- False if it should not use nor generate the
+                cache
+
+        Returns:
+            The ActionsMapBundle
+
+        """
+        loader, source = klass._read_source(namespace)
+
+        if use_cache:
+            # Attempt to load cache and generate it if it's outdated
+            bundle = klass._load_cache(namespace, source)
+            if bundle is not None:
+                return bundle
+            try:
+                return klass._generate_cache(namespace, source, loader)
+            except EnvironmentError as e:
+                logger.warning("unable to generate cache for actions map "
+                               "namespace '%s': %s", namespace, e)
+
+        # Compile the actions map without caching it
+        return ActionsMapBundle(compile_actionsmap(
+            namespace, loader.load(source), get_source_key(source)))
+
+    @classmethod
+    def _load_provided(klass, namespace):
+        """
+        Load the compiled actions map provided with a namespace
+
+        The bundle of the data directory is only used if it has been
+        compiled from the actions map file of the namespace - if any.
+
+        Keyword arguments:
+            - namespace -- The actions map namespace
+
+        Returns:
+            The ActionsMapBundle or None if it's missing or outdated
+
+        """
+        try:
+            bundle = ActionsMapBundle.load('%s/actionsmap/%s.bundle' % \
+                                               (pkg.datadir, namespace))
+        except IOError:
+            return None
+        except ValueError as e:
+            logger.warning("unable to load compiled actions map for "
+                           "namespace '%s': %s", namespace, e)
+            return None
+
+        try:
+            source = klass._read_source(namespace)[1]
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # Only the compiled actions map is provided
+            return bundle
+        if bundle.source_key != get_source_key(source):
+            logger.warning("compiled actions map for namespace '%s' is "
+                           "outdated, its source is used instead", namespace)
+            return None
+        return bundle
+
+    @staticmethod
+    def _load_cache(namespace, source):
+        """
+        Load the cached bundle of a namespace
+
+        Keyword arguments:
+            - namespace -- The actions map namespace
+            - source -- The content of the actions map file
+
+        Returns:
+            The ActionsMapBundle or None if it's missing or outdated
+
+        """
+        try:
+            bundle = ActionsMapBundle.load('%s/actionsmap/%s.bundle' % \
+                                               (pkg.cachedir, namespace))
+        # TODO: Switch to python3 and catch proper exception
+        except (IOError, ValueError):
+            return None
+        if bundle.source_key != get_source_key(source):
+            logger.debug("cache for actions map namespace '%s' is outdated",
+                         namespace)
+            return None
+        return bundle
+
+    @classmethod
+    def _generate_cache(klass, namespace, source, loader):
+        """
+        Generate cache for an actions map namespace
+
+        The bundle is written to a temporary file which is then renamed,
+        so that the cache file is always complete when read. Concurrent
+        builders are serialized with a lock on a file in the cache
+        directory, and the cache is not generated again if it has been
+        meanwhile.
+
+        Keyword arguments:
+            - namespace -- The actions map namespace
+            - source -- The content of the actions map file
+            - loader -- The loader class to load the actions map with
+
+        Returns:
+            The ActionsMapBundle
+
+        """
+        cachedir = pkg.get_cachedir('actionsmap')
+
+        with open('%s/.%s.lock' % (cachedir, namespace), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            # Check if it has been generated while waiting for the lock
+            bundle = klass._load_cache(namespace, source)
+            if bundle is not None:
+                return bundle
+
+            logger.debug("generating cache for actions map namespace '%s'",
+                         namespace)
+            data = compile_actionsmap(namespace, loader.load(source),
+                                      get_source_key(source))
+
+            # Write the bundle and replace the cache file atomically
+            import tempfile
+            fd, tmp_file = tempfile.mkstemp(prefix='.%s.' % namespace,
+                                            dir=cachedir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.chmod(tmp_file, 0644)
+                os.rename(tmp_file, '%s/%s.bundle' % (cachedir, namespace))
+            except:
+                os.unlink(tmp_file)
+                raise
+
+        return ActionsMapBundle(data)
+
+    def _get_batch_arguments(self, tid):
+        """
+        Return the arguments of an action as a list of (name, dest,
+        parameters) and register their extra parameters
+
+        """
+        namespace, category, action = tid
+        try:
+            record = self._bundles[namespace].get_action(category, action)
+        except KeyError:
+            logger.error("unknown action %s.%s.%s", *tid)
+            raise MoulinetteError(errno.EINVAL, m18n.g('error_see_log'))
+
+        arguments = []
+        for argn, full, argp, extra in record['arguments']:
+            dest = get_argument_dest(argn, full, argp)
+            if extra:
+                self.extraparser.add_argument(tid, dest, extra,
+                                              validate=False)
+            arguments.append((argn, dest, argp))
+        return arguments
+
+    @staticmethod
+    def _coerce_arguments(arguments, values):
+        """
+        Convert values of arguments as argparse would do
+
+        Keyword arguments:
+            - arguments -- A list of (name, dest, parameters) for each
+                argument of the action
+            - values -- A dict of argument destinations associated to
+                their value
+
+        Returns:
+            A new dict of all arguments with their converted value
+
+        """
+        values = dict(values)
+        result = {}
+
+        for argn, dest, argp in arguments:
+            action = argp.get('action', 'store')
+            nargs = argp.get('nargs', None)
+            type_ = argp.get('type', None)
+
+            try:
+                value = values.pop(dest)
+            except KeyError:
+                # Set the default value
+                if action in ('store_true', 'store_false'):
+                    value = argp.get('default', action == 'store_false')
+                elif argp.get('required', False) or (argn[0] != '-' and
+                        nargs not in ('?', '*')):
+                    raise MoulinetteError(errno.EINVAL,
+                                          m18n.g('argument_required', dest))
+                else:
+                    value = argp.get('default', None)
+                    if type_ and isinstance(value, basestring):
+                        value = type_(value)
+                result[dest] = value
+                continue
+
+            if action in ('store_true', 'store_false'):
+                result[dest] = bool(value)
+                continue
+            elif action not in ('store', 'append'):
+                raise MoulinetteError(errno.EINVAL,
+                                      m18n.g('invalid_argument', dest,
+                                             m18n.g('argument_unexpected')))
+
+            # Convert value and check choices
+            is_list = action == 'append' or nargs in ('*', '+') or \
+                isinstance(nargs, int)
+            items = value if isinstance(value, list) else [value]
+            if is_list and nargs == '+' and not items:
+                raise MoulinetteError(errno.EINVAL,
+                                      m18n.g('argument_required', dest))
+            elif not is_list and len(items) != 1:
+                raise MoulinetteError(errno.EINVAL,
+                                      m18n.g('invalid_argument', dest,
+                                             m18n.g('argument_unexpected')))
+            if type_:
+                try:
+                    items = [type_(v) for v in items]
+                except (TypeError, ValueError):
+                    raise MoulinetteError(errno.EINVAL,
+                        m18n.g('invalid_argument', dest,
+                               m18n.g('invalid_type',
+                                      getattr(type_, '__name__', 'type'))))
+            choices = argp.get('choices', None)
+            if choices is not None:
+                for v in items:
+                    if v not in choices:
+                        raise MoulinetteError(errno.EINVAL,
+                            m18n.g('invalid_argument', dest,
+                                   m18n.g('invalid_choice',
+                                          ', '.join(map(str, choices)))))
+            result[dest] = items if is_list else items[0]
+
+        if values:
+            raise MoulinetteError(errno.EINVAL,
+                                  m18n.g('invalid_argument',
+                                         sorted(values.keys())[0],
+                                         m18n.g('argument_unexpected')))
+        return result
+
+    def _construct_parser(self, bundles, args=None, **kwargs):
         """
         Construct the parser with the actions map
 
         Keyword arguments:
-            - actionsmaps -- A dict of multi-level dictionnary of
-                categories/actions/arguments list for each namespaces
+            - bundles -- A dict of ActionsMapBundle for each namespaces
+            - args -- The arguments to construct the parser for, the
+                parser class filters actions which are needed for them
             - **kwargs -- Additionnal arguments to pass at the parser
                 class instantiation
 
         Returns:
-            An interface relevant's parser object
+            A 2-tuple of an interface relevant's parser object and
+            either it has been partially constructed or not
 
         """
-        ## Get extra parameters
-        if not self.use_cache:
-            validate_extra = True
-        else:
-            validate_extra = False
-
         ## Add arguments to the parser
         def _add_arguments(tid, parser, arguments):
-            for argn, argp in arguments.items():
-                names = top_parser.format_arg_names(str(argn),
-                                                    argp.pop('full', None))
-                try: argp['type'] = eval(argp['type'])
-                except: pass
-
-                try:
-                    extra = argp.pop('extra')
+            for argn, full, argp, extra in arguments:
+                names = top_parser.format_arg_names(argn, full)
+                if extra:
                     arg_dest = (parser.add_argument(*names, **argp)).dest
                     self.extraparser.add_argument(tid, arg_dest, extra,
-                                                  validate_extra)
-                except KeyError:
+                                                  validate=False)
+                else:
                     # No extra parameters
                     parser.add_argument(*names, **argp)
 
+        ## Add arguments of an action to its parser
+        def _add_action_arguments(bundle, tid, parser):
+            _add_arguments(tid, parser,
+                           bundle.get_action(*tid[1:])['arguments'])
+
         # Instantiate parser
         top_parser = self.parser_class(**kwargs)
 
         # Iterate over actions map namespaces
-        for n, actionsmap in actionsmaps.items():
+        for n, bundle in bundles.items():
             # Retrieve global parameters
-            _global = actionsmap.pop('_global', {})
+            _global = bundle.get_global()
 
             # -- Parse global configuration
-            if 'configuration' in _global:
+            if _global['configuration']:
                 # Set global configuration
                 top_parser.set_global_conf(_global['configuration'])
 
             # -- Parse global arguments
-            if 'arguments' in _global:
+            if _global['arguments']:
                 try:
                     # Get global arguments parser
                     parser = top_parser.add_global_parser()
@@ -581,30 +1493,37 @@ class ActionsMap(object):
                     _add_arguments(GLOBAL_SECTION, parser,
                                    _global['arguments'])
 
+        # Filter needed actions for the arguments
+        needed = None
+        if args is not None:
+            categories = {}
+            for bundle in bundles.values():
+                for cn, cp in bundle.get_categories():
+                    categories.setdefault(cn, []).extend(
+                        [an for an, ap in bundle.get_actions(cn)])
+            needed = top_parser.filter_actions(args, categories)
+            if needed is not None:
+                logger.debug("constructing parser for actions %s only",
+                             needed)
+                needed_categories = set([cn for cn, an in needed])
+
+        # Iterate over actions map namespaces
+        for n, bundle in bundles.items():
             # -- Parse categories
-            for cn, cp in actionsmap.items():
-                try:
-                    actions = cp.pop('actions')
-                except KeyError:
-                    # Invalid category without actions
-                    logger.warning("no actions found in category '%s' in " \
-                                   "namespace '%s'", cn, n)
+            for cn, cp in bundle.get_categories():
+                if needed is not None and cn not in needed_categories:
                     continue
 
-                # Get category parser
+                # Get category parser and configuration
                 cat_parser = top_parser.add_category_parser(cn, **cp)
+                cat_conf = bundle.get_category_conf(cn)
 
                 # -- Parse actions
-                for an, ap in actions.items():
-                    args = ap.pop('arguments', {})
-                    tid = (n, cn, an)
-                    try:
-                        conf = ap.pop('configuration')
-                        _set_conf = lambda p: p.set_conf(tid, conf)
-                    except KeyError:
-                        # No action configuration
-                        _set_conf = lambda p: False
+                for an, ap in bundle.get_actions(cn):
+                    if needed is not None and (cn, an) not in needed:
+                        continue
 
+                    tid = (n, cn, an)
                     try:
                         # Get action parser
                         a_parser = cat_parser.add_action_parser(an, tid, **ap)
@@ -618,7 +1537,34 @@ class ActionsMap(object):
                     else:
                         # Store action identifier and add arguments
                         a_parser.set_defaults(_tid=tid)
-                        _add_arguments(tid, a_parser, args)
-                        _set_conf(cat_parser)
-
-        return top_parser
+                        loader = partial(_add_action_arguments, bundle, tid)
+                        try:
+                            # Defer arguments addition if supported
+                            set_loader = a_parser.set_loader
+                        except AttributeError:
+                            loader(a_parser)
+                        else:
+                            set_loader(loader)
+
+                        # Action configuration overrides the category one
+                        conf = bundle.get_action_conf(cn, an)
+                        if cat_conf:
+                            conf = dict(cat_conf, **(conf or {}))
+                        if conf:
+                            cat_parser.set_conf(tid, conf)
+
+        return (top_parser, needed is not None)
+
+
+def _build_cache_worker(namespace):
+    """Generate cache for a namespace and return (namespace, duration,
+    error)"""
+    start = time()
+    try:
+        ActionsMap.generate_cache([namespace])
+    except Exception as e:
+        logger.debug("unable to generate cache for actions map namespace "
+                     "'%s'", namespace, exc_info=1)
+        return (namespace, time() - start,
+                getattr(e, 'strerror', None) or str(e) or repr(e))
+    return (namespace, time() - start, None)
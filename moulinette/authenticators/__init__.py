@@ -1,14 +1,93 @@
 # -*- coding: utf-8 -*-
 
+import os
+import hmac
+import time
 import errno
-import gnupg
+import struct
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 
 from moulinette.core import MoulinetteError
 
 logger = logging.getLogger('moulinette.authenticator')
 
 
+# Session encryption ---------------------------------------------------
+
+"""The magic string of session files"""
+SESSION_MAGIC = 'MSE1'
+
+"""The time period for which a decrypted session is kept in memory"""
+SESSION_CACHE_TTL = 60
+
+# Decrypted sessions as {path: (mtime, hash digest, password, expiration)}
+_sessions_cache = {}
+_sessions_cache_lock = threading.Lock()
+
+def _derive_keys(session_hash, salt):
+    """Return the encryption and authentication keys of a session
+
+    The session hash is random, so that keys are derived with HMAC only
+    instead of a slow key derivation function.
+
+    """
+    return (hmac.new(session_hash, salt + 'encryption', hashlib.sha256).digest(),
+            hmac.new(session_hash, salt + 'authentication',
+                     hashlib.sha256).digest())
+
+def _xor_keystream(key, data):
+    """Encrypt or decrypt data with a HMAC-SHA256 keystream in counter
+    mode"""
+    out = []
+    for i in xrange(0, len(data), 32):
+        block = hmac.new(key, struct.pack('>Q', i / 32),
+                         hashlib.sha256).digest()
+        out.append(''.join([chr(ord(c) ^ ord(k))
+                            for c, k in zip(data[i:i+32], block)]))
+    return ''.join(out)
+
+def encrypt_session(session_hash, password):
+    """Encrypt and authenticate a password with a session hash
+
+    Keyword arguments:
+        - session_hash -- The session hash to derive keys from
+        - password -- The password to encrypt
+
+    Returns:
+        The encrypted session as a string
+
+    """
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    salt = os.urandom(16)
+    enc_key, mac_key = _derive_keys(session_hash, salt)
+    data = SESSION_MAGIC + salt + _xor_keystream(enc_key, password)
+    return data + hmac.new(mac_key, data, hashlib.sha256).digest()
+
+def decrypt_session(session_hash, data):
+    """Verify and decrypt a session encrypted by encrypt_session
+
+    Keyword arguments:
+        - session_hash -- The session hash to derive keys from
+        - data -- The encrypted session
+
+    Returns:
+        The password, or None if the session is invalid
+
+    """
+    if len(data) < 52 or not data.startswith(SESSION_MAGIC):
+        return None
+    data, tag = data[:-32], data[-32:]
+    enc_key, mac_key = _derive_keys(session_hash, data[4:20])
+    if not hmac.compare_digest(
+            hmac.new(mac_key, data, hashlib.sha256).digest(), tag):
+        return None
+    return _xor_keystream(enc_key, data[20:])
+
+
 # Base Class -----------------------------------------------------------
 
 class BaseAuthenticator(object):
@@ -65,6 +144,10 @@ class BaseAuthenticator(object):
         raise NotImplementedError("derived class '%s' must override this method" % \
                                       self.__class__.__name__)
 
+    def close(self):
+        """Free resources of the authentication, if any"""
+        pass
+
 
     ## Authentication methods
 
@@ -130,36 +213,228 @@ class BaseAuthenticator(object):
 
     ## Private methods
 
-    def _open_sessionfile(self, session_id, mode='r'):
+    def _get_sessionfile(self, session_id, ext='enc'):
+        """Return the path to a session file for this instance"""
+        return os.path.join(pkg.get_cachedir('session/%s' % self.name),
+                            '%s.%s' % (session_id, ext))
+
+    def _open_sessionfile(self, session_id, mode='r', ext='enc'):
         """Open a session file for this instance in given mode"""
-        return pkg.open_cachefile('%s.asc' % session_id, mode,
+        return pkg.open_cachefile('%s.%s' % (session_id, ext), mode,
                                   subdir='session/%s' % self.name)
 
     def _store_session(self, session_id, session_hash, password):
         """Store a session and its associated password"""
-        gpg = gnupg.GPG()
-        gpg.encoding = 'utf-8'
-        with self._open_sessionfile(session_id, 'w') as f:
-            f.write(str(gpg.encrypt(password, None, symmetric=True,
-                                    passphrase=session_hash)))
+        import tempfile
+
+        path = self._get_sessionfile(session_id)
+
+        # Write the session and replace the file atomically, so that it
+        # is always complete when read
+        fd, tmp_file = tempfile.mkstemp(prefix='.%s.' % session_id,
+                                        dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encrypt_session(session_hash, password))
+            os.rename(tmp_file, path)
+        except:
+            os.unlink(tmp_file)
+            raise
+
+        # Remove a session file of the previous format
+        try:
+            os.unlink(self._get_sessionfile(session_id, 'asc'))
+        except OSError:
+            pass
+        self._cache_session(path, session_hash, password)
 
     def _retrieve_session(self, session_id, session_hash):
         """Retrieve a session and return its associated password"""
+        path = self._get_sessionfile(session_id)
         try:
-            with self._open_sessionfile(session_id, 'r') as f:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return self._migrate_session(session_id, session_hash)
+
+        # Use the decrypted password if the file is unchanged
+        h = hashlib.sha256(session_hash).digest()
+        with _sessions_cache_lock:
+            try:
+                c_mtime, c_hash, password, expiration = _sessions_cache[path]
+            except KeyError:
+                pass
+            else:
+                if c_mtime != mtime or expiration <= time.time():
+                    # Drop the password of a changed or expired session
+                    del _sessions_cache[path]
+                elif hmac.compare_digest(c_hash, h):
+                    return password
+
+        try:
+            with self._open_sessionfile(session_id, 'rb') as f:
+                password = decrypt_session(session_hash, f.read())
+        except IOError:
+            logger.debug("unable to retrieve session", exc_info=1)
+            raise MoulinetteError(errno.ENOENT,
+                                  m18n.g('unable_retrieve_session'))
+        if password is None:
+            logger.error("unable to decrypt password for the session")
+            raise MoulinetteError(errno.EINVAL,
+                                  m18n.g('unable_retrieve_session'))
+        self._cache_session(path, session_hash, password, mtime)
+        return password
+
+    def _migrate_session(self, session_id, session_hash):
+        """Retrieve a session stored with GnuPG and store it again"""
+        try:
+            with self._open_sessionfile(session_id, 'r', 'asc') as f:
                 enc_pwd = f.read()
         except IOError:
             logger.debug("unable to retrieve session", exc_info=1)
             raise MoulinetteError(errno.ENOENT,
                                   m18n.g('unable_retrieve_session'))
+
+        import gnupg
+        gpg = gnupg.GPG()
+        gpg.encoding = 'utf-8'
+
+        decrypted = gpg.decrypt(enc_pwd, passphrase=session_hash)
+        if decrypted.ok != True:
+            logger.error("unable to decrypt password for the session: %s",
+                         decrypted.status)
+            raise MoulinetteError(errno.EINVAL,
+                                  m18n.g('unable_retrieve_session'))
+        try:
+            self._store_session(session_id, session_hash, decrypted.data)
+        except:
+            logger.exception("unable to store session")
         else:
-            gpg = gnupg.GPG()
-            gpg.encoding = 'utf-8'
-
-            decrypted = gpg.decrypt(enc_pwd, passphrase=session_hash)
-            if decrypted.ok != True:
-                logger.error("unable to decrypt password for the session: %s",
-                             decrypted.status)
-                raise MoulinetteError(errno.EINVAL,
-                                      m18n.g('unable_retrieve_session'))
-            return decrypted.data
+            logger.debug("session has been migrated")
+        return decrypted.data
+
+    def _cache_session(self, path, session_hash, password, mtime=None):
+        """Keep a decrypted session in memory for a short time"""
+        now = time.time()
+        if mtime is None:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                return
+        entry = (mtime, hashlib.sha256(session_hash).digest(),
+                 password, now + SESSION_CACHE_TTL)
+
+        with _sessions_cache_lock:
+            for p, c in _sessions_cache.items():
+                if c[3] <= now:
+                    del _sessions_cache[p]
+            _sessions_cache[path] = entry
+
+
+# Authenticators pool --------------------------------------------------
+
+class AuthenticatorPool(object):
+    """Pool of authenticated authenticators of sessions
+
+    Keep the authenticator of each session and profile once it has been
+    used, so that a next request of the session reuses it instead of
+    authenticating again - e.g. opening and binding a new connection.
+
+    An authenticator is taken from the pool while it is used, so that it
+    is never shared between concurrent requests. It is checked before
+    being reused and closed once it has not been used for 'idle_timeout'
+    seconds, or when the pool is full and it is the least recently used.
+
+    Keyword arguments:
+        - maxsize -- The maximum number of authenticators to keep
+        - idle_timeout -- The time period after which an unused
+            authenticator is closed
+
+    """
+    def __init__(self, maxsize=100, idle_timeout=300):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+
+        # {(session id, profile): (hash digest, authenticator, last use)}
+        self._authenticators = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, session_id, profile, session_hash):
+        """Take the authenticator of a session from the pool
+
+        Keyword arguments:
+            - session_id -- The session identifier
+            - profile -- The authenticator profile name
+            - session_hash -- The session hash of the profile
+
+        Returns:
+            The authenticated instance, or None if there is no usable one
+
+        """
+        key = (session_id, profile)
+        digest = hashlib.sha256(session_hash).digest()
+        with self._lock:
+            try:
+                h, auth, last_use = self._authenticators[key]
+            except KeyError:
+                return None
+            if not hmac.compare_digest(h, digest):
+                # Leave it to the session which owns it
+                return None
+            del self._authenticators[key]
+
+        if time.time() - last_use > self.idle_timeout \
+                or not auth.is_authenticated:
+            self._close(auth)
+            return None
+        return auth
+
+    def release(self, session_id, profile, session_hash, authenticator):
+        """Put the authenticator of a session in the pool
+
+        Keyword arguments:
+            - session_id -- The session identifier
+            - profile -- The authenticator profile name
+            - session_hash -- The session hash of the profile
+            - authenticator -- The authenticated instance
+
+        """
+        closed = []
+        with self._lock:
+            entry = self._authenticators.pop((session_id, profile), None)
+            if entry is not None:
+                closed.append(entry[1])
+            self._authenticators[(session_id, profile)] = (
+                hashlib.sha256(session_hash).digest(), authenticator,
+                time.time())
+            while len(self._authenticators) > self.maxsize:
+                closed.append(self._authenticators.popitem(last=False)[1][1])
+        for auth in closed:
+            self._close(auth)
+
+    def evict(self, session_id):
+        """Close the authenticators of a session"""
+        with self._lock:
+            keys = [k for k in self._authenticators if k[0] == session_id]
+            closed = [self._authenticators.pop(k)[1] for k in keys]
+        for auth in closed:
+            self._close(auth)
+
+    def sweep(self):
+        """Close the authenticators which have not been used recently"""
+        deadline = time.time() - self.idle_timeout
+        closed = []
+        with self._lock:
+            for key, (h, auth, last_use) in self._authenticators.items():
+                if last_use >= deadline:
+                    # Next ones have been used later
+                    break
+                closed.append(self._authenticators.pop(key)[1])
+        for auth in closed:
+            self._close(auth)
+
+    def _close(self, authenticator):
+        try:
+            authenticator.close()
+        except:
+            logger.warning("unable to close authenticator '%s'",
+                           authenticator.name, exc_info=1)
@@ -45,8 +45,7 @@ class Authenticator(BaseAuthenticator):
 
     def __del__(self):
         """Disconnect and free ressources"""
-        if self.con:
-            self.con.unbind_s()
+        self.close()
 
 
     ## Implement virtual properties
@@ -68,6 +67,12 @@ class Authenticator(BaseAuthenticator):
 
     ## Implement virtual methods
 
+    def close(self):
+        """Disconnect from the server"""
+        if self.con:
+            con, self.con = self.con, None
+            con.unbind_s()
+
     def authenticate(self, password):
         try:
             con = ldap.initialize(self.uri)
@@ -4,8 +4,15 @@ import os
 import sys
 import time
 import json
+import mmap
+import fcntl
 import errno
+import bisect
+import struct
+import signal
+import threading
 import logging
+import cPickle as pickle
 
 from importlib import import_module
 
@@ -126,24 +133,54 @@ class Translator(object):
     Provide an internationalization mechanism based on JSON files to
     translate a key in the proper locale.
 
+    Translations of a locale are compiled into a catalog when it is set,
+    in which missing keys are taken from the default locale. Each value
+    is stored UTF-8 encoded and marked as a template to format or not,
+    so that a translation is retrieved with a single lookup.
+
+    If a LocalesBundle is given and it is up to date for the directory,
+    compiled catalogs are loaded from it instead of locale files.
+
+    Keys which are missing - or taken from the default locale - are
+    counted per locale and missing ones are logged only the first time.
+
     Keyword arguments:
         - locale_dir -- The directory where locale files are located
         - default_locale -- The default locale to use
+        - bundle -- A LocalesBundle to load catalogs from
 
     """
-    def __init__(self, locale_dir, default_locale='en'):
+    def __init__(self, locale_dir, default_locale='en', bundle=None):
         self.locale_dir = locale_dir
         self.locale = default_locale
+        self.default_locale = default_locale
         self._translations = {}
+        self._catalogs = {}
+        self._all_loaded = False
+        self._stats = {}
+
+        self._bundle = None
+        self._bundled = None
+        if bundle is not None:
+            locales = bundle.get_locales(locale_dir, default_locale)
+            if locales is None:
+                logger.debug("locales bundle is not up to date for '%s'",
+                             locale_dir)
+            else:
+                self._bundle = bundle
+                self._bundled = set(locales)
+                self._all_loaded = True
 
         # Attempt to load default translations
         if not self._load_translations(default_locale):
             logger.error("unable to load locale '%s' from '%s'",
                          default_locale, locale_dir)
-        self.default_locale = default_locale
+        self._catalog = self._get_catalog(default_locale)
 
     def get_locales(self):
         """Return a list of the avalaible locales"""
+        if self._bundled is not None:
+            return list(self._bundled)
         locales = []
 
         for f in os.listdir(self.locale_dir):
@@ -172,10 +209,12 @@ class Translator(object):
 
                 # Revert to default locale
                 self.locale = self.default_locale
+                self._catalog = self._get_catalog(self.default_locale)
                 return False
 
         # Set current locale
         self.locale = locale
+        self._catalog = self._get_catalog(locale)
         return True
 
     def translate(self, key, *args, **kwargs):
@@ -188,22 +227,102 @@ class Translator(object):
             - key -- The key to translate
 
         """
-        def _load_key(locale):
-            value = self._translations[locale][key]
-            return value.encode('utf-8').format(*args, **kwargs)
+        return self._translate(self._catalog, self.locale, key, args, kwargs)
+
+    def translate_in(self, locale, key, *args, **kwargs):
+        """Retrieve translation for a key in a given locale
+
+        Attempt to retrieve translation for a key using the given locale
+        - which is loaded if needed - or the default locale if 'key' is
+        not found or the locale is not available. The current locale is
+        left unchanged.
+
+        Keyword arguments:
+            - locale -- The locale to use
+            - key -- The key to translate
+
+        """
+        try:
+            catalog = self._catalogs[locale]
+        except KeyError:
+            if self._bundled is not None:
+                available = locale in self._bundled
+            else:
+                available = not self._all_loaded and \
+                    self._load_translations(locale)
+            if available:
+                catalog = self._get_catalog(locale)
+            else:
+                # Use the default one for an unavailable locale, which is
+                # not stored since it may be any requested value
+                locale = self.default_locale
+                catalog = self._get_catalog(locale)
+        return self._translate(catalog, locale, key, args, kwargs)
+
+    def load_all(self):
+        """Load and compile translations of all available locales"""
+        for locale in self.get_locales():
+            if self._load_translations(locale):
+                self._get_catalog(locale)
+        self._all_loaded = True
+
+    def get_stats(self):
+        """Return the counters of missing and fallback keys
 
+        Returns:
+            A dict of {locale: {key: {'misses': int, 'fallbacks': int}}}
+
+        """
+        stats = {}
+        for (locale, key), (misses, fallbacks) in self._stats.items():
+            stats.setdefault(locale, {})[key] = {
+                'misses': misses,
+                'fallbacks': fallbacks,
+            }
+        return stats
+
+    def reset_stats(self):
+        """Reset the counters of missing and fallback keys"""
+        self._stats = {}
+
+    def _count(self, locale, key, index):
+        """Increment a counter - 0 for misses and 1 for fallbacks - of a
+        key and return True if it is the first time"""
         try:
-            return _load_key(self.locale)
-        except (KeyError, IndexError):
-            if self.default_locale != self.locale:
-                logger.info("untranslated key '%s' for locale '%s'",
-                            key, self.locale)
-                try:
-                    return _load_key(self.default_locale)
-                except:
+            counters = self._stats[(locale, key)]
+        except KeyError:
+            counters = self._stats[(locale, key)] = [0, 0]
+        counters[index] += 1
+        return counters[index] == 1
+
+    def _translate(self, catalog, locale, key, args, kwargs):
+        """Retrieve translation for a key from a compiled catalog"""
+        try:
+            value, is_template, is_fallback = catalog[key]
+        except KeyError:
+            pass
+        else:
+            if is_fallback:
+                self._count(locale, key, 1)
+            if not is_template:
+                return value
+            try:
+                return value.format(*args, **kwargs)
+            except (KeyError, IndexError):
+                default = self._get_catalog(self.default_locale)
+                if is_fallback or catalog is default:
                     pass
-        logger.warning("unable to retrieve key '%s' for default locale '%s'",
-                       key, self.default_locale)
+                else:
+                    if self._count(locale, key, 1):
+                        logger.info("unable to format key '%s' for locale "
+                                    "'%s'", key, locale)
+                    try:
+                        return default[key][0].format(*args, **kwargs)
+                    except:
+                        pass
+        if self._count(locale, key, 0):
+            logger.warning("unable to retrieve key '%s' for default locale "
+                           "'%s'", key, self.default_locale)
         return key
 
     def _load_translations(self, locale, overwrite=False):
@@ -220,6 +339,8 @@ class Translator(object):
             True if the translations have been loaded, otherwise False
 
         """
+        if self._bundled is not None:
+            return locale in self._bundled
         if not overwrite and locale in self._translations:
             return True
 
@@ -230,8 +351,200 @@ class Translator(object):
             return False
         else:
             self._translations[locale] = j
+
+            # Invalidate compiled catalogs which use them
+            if locale == self.default_locale:
+                self._catalogs.clear()
+            else:
+                self._catalogs.pop(locale, None)
         return True
 
+    def _get_catalog(self, locale):
+        """Return the compiled catalog of a locale
+
+        The catalog is a dict of the translation of each key as a 3-tuple
+        (value, is_template, is_fallback) where 'value' is UTF-8 encoded,
+        'is_template' tells if it must be formatted and 'is_fallback' if
+        it comes from the default locale.
+
+        """
+        try:
+            return self._catalogs[locale]
+        except KeyError:
+            pass
+
+        if self._bundled is not None:
+            catalog = self._catalogs[locale] = \
+                self._bundle.get_catalog(self.locale_dir, locale) \
+                if locale in self._bundled else {}
+            return catalog
+
+        def _compile(translations, is_fallback):
+            for key, value in translations.items():
+                value = value.encode('utf-8')
+                catalog[key] = (value, '{' in value or '}' in value,
+                                is_fallback)
+
+        catalog = {}
+        if locale != self.default_locale:
+            _compile(self._translations.get(self.default_locale, {}), True)
+        _compile(self._translations.get(locale, {}), False)
+        if logger.isEnabledFor(logging.DEBUG) and \
+                locale != self.default_locale:
+            missing = [k for k, v in catalog.items() if v[2]]
+            if missing:
+                logger.debug("untranslated keys for locale '%s' in '%s': %s",
+                             locale, self.locale_dir, ', '.join(missing))
+
+        self._catalogs[locale] = catalog
+        return catalog
+
+
+"""The magic string and the format version of a locales bundle"""
+LOCALES_BUNDLE_MAGIC = 'MLCB'
+LOCALES_BUNDLE_VERSION = 1
+
+# Bundle header: magic, format version, index offset and index length
+_locales_bundle_header = struct.Struct('>4sHQQ')
+
+def _get_locales_stamp(locale_dir):
+    """Return the modification stamp of the locale files of a directory
+    as a 2-tuple (directory mtime, list of (name, mtime, size))"""
+    files = []
+    for f in sorted(os.listdir(locale_dir)):
+        if f.endswith('.json'):
+            st = os.stat(os.path.join(locale_dir, f))
+            files.append((f, st.st_mtime, st.st_size))
+    return (os.stat(locale_dir).st_mtime, files)
+
+def compile_locales(locale_dirs, default_locale='en'):
+    """Compile locale files into a bundle
+
+    Translations of each locale of the directories are compiled as
+    Translator does and stored as a separate record, so that they can
+    be loaded only when needed. The records are referenced by an index
+    - with the modification stamp of each directory - which is stored
+    at the end of the bundle and pointed by the header.
+
+    Keyword arguments:
+        - locale_dirs -- A list of directories where locale files are
+            located
+        - default_locale -- The default locale to compile with
+
+    Returns:
+        The compiled bundle as a string
+
+    """
+    chunks = []
+    offset = [_locales_bundle_header.size]
+
+    ## Append a record and return its position
+    def _add_record(record):
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        position = (offset[0], len(data))
+        chunks.append(data)
+        offset[0] += len(data)
+        return position
+
+    index = {'default_locale': default_locale, 'dirs': {}}
+    for locale_dir in locale_dirs:
+        stamp = _get_locales_stamp(locale_dir)
+        translator = Translator(locale_dir, default_locale)
+        translator.load_all()
+
+        locales = {}
+        for locale in translator.get_locales():
+            locales[locale] = _add_record(translator._get_catalog(locale))
+        index['dirs'][locale_dir] = (stamp, locales)
+
+    # Append the index and prepend the header
+    index_pos = _add_record(index)
+    chunks.insert(0, _locales_bundle_header.pack(
+        LOCALES_BUNDLE_MAGIC, LOCALES_BUNDLE_VERSION, *index_pos))
+    return ''.join(chunks)
+
+class LocalesBundle(object):
+    """Compiled locales of several directories
+
+    Provide a read access to the catalogs compiled with compile_locales.
+    Only the index is loaded at initialization, and catalogs are
+    unserialized on demand.
+
+    Keyword arguments:
+        - buf -- The compiled bundle as a string or a mmap object
+
+    """
+    def __init__(self, buf):
+        try:
+            magic, version, offset, length = _locales_bundle_header.unpack(
+                buf[:_locales_bundle_header.size])
+        except struct.error:
+            raise ValueError("truncated locales bundle")
+        if magic != LOCALES_BUNDLE_MAGIC or version != LOCALES_BUNDLE_VERSION:
+            raise ValueError("unsupported locales bundle")
+
+        self._buf = buf
+        self._index = self._load_record((offset, length))
+
+    @classmethod
+    def load(klass, path):
+        """Map a bundle file to memory and return its bundle
+
+        Keyword arguments:
+            - path -- The path to the bundle file
+
+        """
+        with open(path, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # The file is empty or cannot be mapped
+                raise ValueError("unable to map locales bundle")
+        return klass(buf)
+
+    def get_locales(self, locale_dir, default_locale):
+        """Return the list of locales of a directory
+
+        Return None if the directory is not in the bundle, if it has
+        been compiled with another default locale or if its locale files
+        have changed since.
+
+        Keyword arguments:
+            - locale_dir -- The directory where locale files are located
+            - default_locale -- The default locale to use
+
+        """
+        try:
+            (dir_mtime, files), locales = self._index['dirs'][locale_dir]
+        except KeyError:
+            return None
+        if default_locale != self._index['default_locale']:
+            return None
+
+        # Check that locale files are unchanged
+        try:
+            if os.stat(locale_dir).st_mtime != dir_mtime:
+                return None
+            for f, mtime, size in files:
+                st = os.stat(os.path.join(locale_dir, f))
+                if st.st_mtime != mtime or st.st_size != size:
+                    return None
+        except OSError:
+            return None
+        return locales.keys()
+
+    def get_catalog(self, locale_dir, locale):
+        """Return the compiled catalog of a locale of a directory"""
+        return self._load_record(self._index['dirs'][locale_dir][1][locale])
+
+    def _load_record(self, (offset, length)):
+        """Unserialize a record from its position"""
+        return pickle.loads(self._buf[offset:offset+length])
+
+
+class _LocaleContext(object):
+    """Global context of the locale"""
+    locale = None
 
 class Moulinette18n(object):
     """Internationalization service for the moulinette
@@ -239,6 +552,10 @@ class Moulinette18n(object):
     Manage internationalization and access to the proper keys translation
     used in the moulinette and libraries.
 
+    The locale to use is stored on a context object, which is global by
+    default. A thread or greenlet local object can be set as context
+    with set_context, so that each of them has its own locale.
+
     Keyword arguments:
         - package -- The current Package instance
         - default_locale -- The default locale to use
@@ -246,16 +563,29 @@ class Moulinette18n(object):
     """
     def __init__(self, package, default_locale='en'):
         self.default_locale = default_locale
-        self.locale = default_locale
         self.pkg = package
 
         # Init global translator
-        self._global = Translator(self.pkg.localedir, default_locale)
+        self._bundle = self._load_bundle()
+        self._global = Translator(self.pkg.localedir, default_locale,
+                                  self._bundle)
 
         # Define namespace related variables
         self._namespaces = {}
         self._current_namespace = None
 
+        # Define locale related variables
+        self._context = _LocaleContext()
+        self._preload = False
+
+        # Keys which cannot be translated, as {(namespace, key): count}
+        self._errors = {}
+
+    @property
+    def locale(self):
+        """Return the locale of the current context"""
+        return getattr(self._context, 'locale', None) or self.default_locale
+
     @property
     def _namespace(self):
         """Return current namespace's Translator object"""
@@ -274,20 +604,90 @@ class Moulinette18n(object):
         if namespace not in self._namespaces:
             # Create new Translator object
             n = Translator('%s/%s/locales' % (self.pkg.libdir, namespace),
-                           self.default_locale)
-            n.set_locale(self.locale)
+                           self.default_locale, self._bundle)
+            if self._preload:
+                n.load_all()
             self._namespaces[namespace] = n
 
         # Set current namespace
         self._current_namespace = namespace
 
     def set_locale(self, locale):
-        """Set the locale to use"""
-        self.locale = locale
+        """Set the locale to use in the current context
 
-        self._global.set_locale(locale)
+        The translations for the locale are loaded on first use, and the
+        default locale is used if it is not available.
+
+        Keyword arguments:
+            - locale -- The locale to use
+
+        """
+        self._context.locale = locale
+
+    def set_context(self, context):
+        """Set the object which holds the locale
+
+        Keyword arguments:
+            - context -- An object on which the locale is stored as the
+                'locale' attribute, e.g. a thread or greenlet local one
+
+        """
+        self._context = context
+
+    def preload_locales(self):
+        """Load translations of all available locales
+
+        Load and compile translations for all locales of the moulinette
+        and of loaded namespaces - and of namespaces loaded afterwards -
+        so that no file is read when a locale is used.
+
+        """
+        self._preload = True
+        self._global.load_all()
         for n in self._namespaces.values():
-            n.set_locale(locale)
+            n.load_all()
+
+    def _load_bundle(self):
+        """Return the LocalesBundle of the cache directory or None"""
+        path = '%s/catalog.bundle' % self.pkg.get_cachedir('locales',
+                                                           make_dir=False)
+        try:
+            return LocalesBundle.load(path)
+        except IOError:
+            return None
+        except ValueError as e:
+            logger.warning("unable to load locales bundle '%s': %s", path, e)
+            return None
+
+    def build_bundle(self, namespaces=[]):
+        """Compile locales into a bundle in the cache directory
+
+        Compile locale files of the moulinette and of the given
+        namespaces, so that they are loaded from the bundle while they
+        don't change.
+
+        Keyword arguments:
+            - namespaces -- A list of namespaces to compile locales for
+
+        """
+        import tempfile
+
+        locale_dirs = [self.pkg.localedir] + \
+            ['%s/%s/locales' % (self.pkg.libdir, n) for n in namespaces]
+        data = compile_locales([d for d in locale_dirs if os.path.isdir(d)],
+                               self.default_locale)
+
+        # Write the bundle and replace the cache file atomically
+        cachedir = self.pkg.get_cachedir('locales')
+        fd, tmp_file = tempfile.mkstemp(prefix='.catalog.', dir=cachedir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_file, 0644)
+            os.rename(tmp_file, '%s/catalog.bundle' % cachedir)
+        except:
+            os.unlink(tmp_file)
+            raise
 
     def g(self, key, *args, **kwargs):
         """Retrieve proper translation for a moulinette key
@@ -299,7 +699,7 @@ class Moulinette18n(object):
             - key -- The key to translate
 
         """
-        return self._global.translate(key, *args, **kwargs)
+        return self._global.translate_in(self.locale, key, *args, **kwargs)
 
     def n(self, key, *args, **kwargs):
         """Retrieve proper translation for a moulinette key
@@ -313,12 +713,64 @@ class Moulinette18n(object):
 
         """
         try:
-            return self._namespace.translate(key, *args, **kwargs)
-        except:
-            logger.exception("cannot translate key '%s' for namespace '%s'",
-                             key, self._current_namespace)
+            return self._namespace.translate_in(self.locale, key,
+                                                *args, **kwargs)
+        except Exception as e:
+            error = (self._current_namespace, key)
+            if error not in self._errors:
+                self._errors[error] = 0
+                logger.warning("cannot translate key '%s' for namespace "
+                               "'%s': %r", key, self._current_namespace, e)
+            self._errors[error] += 1
             return key
 
+    def get_stats(self):
+        """Return the counters of keys which are not translated
+
+        For the moulinette - with 'moulinette' as name - and each loaded
+        namespace, return the counters of Translator.get_stats for each
+        locale and key. Keys whose translation failed are counted as
+        misses in the 'errors' pseudo-locale.
+
+        Returns:
+            A dict of {name: {locale: {key: {'misses': int,
+                                             'fallbacks': int}}}}
+
+        """
+        stats = {'moulinette': self._global.get_stats()}
+        for name, n in self._namespaces.items():
+            stats[name] = n.get_stats()
+        for (name, key), count in self._errors.items():
+            stats.setdefault(name, {}).setdefault('errors', {})[key] = {
+                'misses': count,
+                'fallbacks': 0,
+            }
+        return stats
+
+    def reset_stats(self):
+        """Reset the counters of keys which are not translated"""
+        self._global.reset_stats()
+        for n in self._namespaces.values():
+            n.reset_stats()
+        self._errors = {}
+
+    def print_stats(self, stream=None):
+        """Write the counters of keys which are not translated, the most
+        missing ones first"""
+        if stream is None:
+            stream = sys.stderr
+        rows = []
+        for name, locales in self.get_stats().items():
+            for locale, keys in locales.items():
+                for key, c in keys.items():
+                    rows.append((c['misses'], c['fallbacks'],
+                                 name, locale, key))
+        stream.write("translations: misses | fallbacks | "
+                     "namespace:locale:key\n")
+        for misses, fallbacks, name, locale, key in sorted(rows, reverse=True):
+            stream.write("translations: %6d | %9d | %s:%s:%s\n" % (
+                misses, fallbacks, name, locale, key))
+
 
 class MoulinetteSignals(object):
     """Signals connector for the moulinette
@@ -507,10 +959,44 @@ def clean_session(session_id, profiles=[]):
         profiles = os.listdir(sessiondir)
 
     for p in profiles:
+        for ext in ('enc', 'asc'):
+            try:
+                os.unlink(os.path.join(sessiondir, p,
+                                       '%s.%s' % (session_id, ext)))
+            except OSError:
+                pass
+
+def sweep_sessions(is_alive, min_age=60):
+    """Remove cache of dead sessions
+
+    Remove the cache of each session for which 'is_alive' returns False
+    and which has not been modified for 'min_age' seconds - so that a
+    session being opened is kept.
+
+    Keyword arguments:
+        - is_alive -- A callable which returns True if a session id
+            is still in use
+        - min_age -- The time period after which a cache can be removed
+
+    """
+    sessiondir = pkg.get_cachedir('session')
+    deadline = time.time() - min_age
+
+    for p in os.listdir(sessiondir):
+        profiledir = os.path.join(sessiondir, p)
         try:
-            os.unlink(os.path.join(sessiondir, p, '%s.asc' % session_id))
+            filenames = os.listdir(profiledir)
         except OSError:
-            pass
+            continue
+        for f in filenames:
+            if not f.endswith(('.enc', '.asc')) or is_alive(f[:-4]):
+                continue
+            path = os.path.join(profiledir, f)
+            try:
+                if os.stat(path).st_mtime < deadline:
+                    os.unlink(path)
+            except OSError:
+                pass
 
 
 # Moulinette core classes ----------------------------------------------
@@ -520,58 +1006,155 @@ class MoulinetteError(OSError):
     pass
 
 
+class _LockTimeout(Exception):
+    pass
+
+class Histogram(object):
+    """Distribution of durations
+
+    Count values in buckets of fixed upper bounds - in seconds - and
+    keep their sum and maximum.
+
+    """
+    bounds = (.001, .01, .1, .5, 1, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def add(self, value):
+        """Add a value to the distribution"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self):
+        """Return the distribution as a dict where 'buckets' is a list of
+        (upper bound, count) - the last upper bound being None"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': zip(self.bounds + (None,), self.counts),
+        }
+
+    @staticmethod
+    def merge(a, b):
+        """Return the sum of two distributions as returned by as_dict"""
+        return {
+            'count': a['count'] + b['count'],
+            'sum': a['sum'] + b['sum'],
+            'max': max(a['max'], b['max']),
+            'buckets': [(ba[0], ba[1] + bb[1])
+                        for ba, bb in zip(a['buckets'], b['buckets'])],
+        }
+
+class _LockStats(object):
+    """Contention statistics of a namespace lock in this process"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait = Histogram()
+        self.hold = Histogram()
+        self.holders = []
+
+    def as_dict(self):
+        return {
+            'acquired': self.acquired,
+            'contended': self.contended,
+            'timeouts': self.timeouts,
+            'wait': self.wait.as_dict(),
+            'hold': self.hold.as_dict(),
+            'holders': [h.get_info() for h in self.holders],
+        }
+
 class MoulinetteLock(object):
     """Locker for a moulinette instance
 
     It provides a lock mechanism for a given moulinette instance. It can
     be used in a with statement as it has a context-manager support.
 
+    The lock is a flock on the lock file of the namespace, so that it
+    is released by the kernel if the holder dies and that a waiter
+    acquires it as soon as it is released. It is either exclusive or
+    shared with other shared holders - i.e. for read-only actions. The
+    exclusive holder's PID and action are written to the lock file for
+    diagnostics.
+
     Keyword arguments:
         - namespace -- The namespace to lock
         - timeout -- The time period before failing if the lock cannot
-            be acquired
+            be acquired, None to wait indefinitely
         - interval -- The time period before trying again to acquire the
-            lock
+            lock, for derived classes which poll it
+        - action -- A description of the action holding the lock
+        - shared -- True to acquire a shared lock instead of an
+            exclusive one
+        - action_id -- The logging identifier of the action
 
     """
-    def __init__(self, namespace, timeout=0, interval=.5):
+    _stats = {}
+
+    def __init__(self, namespace, timeout=0, interval=.1, action=None,
+                 shared=False, action_id=None):
         self.namespace = namespace
         self.timeout = timeout
         self.interval = interval
+        self.action = action
+        self.shared = shared
+        self.action_id = action_id
 
         self._lockfile = '/var/run/moulinette_%s.lock' % namespace
+        self._fd = None
         self._locked = False
         self._bypass = False
 
     def acquire(self):
         """Attempt to acquire the lock for the moulinette instance
 
-        It will try to write to the lock file only if it doesn't exist.
-        Otherwise, it will wait and try again until the timeout expires
-        or the lock file doesn't exist.
+        It will try to lock the lock file without blocking. Otherwise,
+        it will wait until the lock is released or the timeout expires.
 
         """
-        start_time = time.time()
-
-        while True:
-            if 'BYPASS_LOCK' in os.environ and os.environ['BYPASS_LOCK'] == 'yes':
-                self._bypass = True
-                break
-
-            if not os.path.isfile(self._lockfile):
-                # Create the lock file
-                try:
-                    (open(self._lockfile, 'w')).close()
-                except IOError:
-                    raise MoulinetteError(errno.EPERM,
-                                          '%s. %s.' % (m18n.g('permission_denied'), m18n.g('root_required')))
-                break
-
-            if (time.time() - start_time) > self.timeout:
-                raise MoulinetteError(errno.EBUSY,
-                                      m18n.g('instance_already_running'))
-            # Wait before checking again
-            time.sleep(self.interval)
+        if 'BYPASS_LOCK' in os.environ and os.environ['BYPASS_LOCK'] == 'yes':
+            self._bypass = True
+        else:
+            try:
+                self._fd = os.open(self._lockfile, os.O_RDWR | os.O_CREAT,
+                                   0644)
+            except OSError:
+                raise MoulinetteError(errno.EPERM,
+                                      '%s. %s.' % (m18n.g('permission_denied'), m18n.g('root_required')))
+
+            stats = self._get_stats(self.namespace)
+            start = time.time()
+            try:
+                if not self._try():
+                    stats.contended += 1
+                    if not self._wait(self.timeout):
+                        stats.timeouts += 1
+                        logger.warning("lock of namespace '%s' is held by %s",
+                                       self.namespace,
+                                       self.get_holder(self.namespace))
+                        raise MoulinetteError(errno.EBUSY,
+                                              m18n.g('instance_already_running'))
+                self._acquired_at = time.time()
+                if not self.shared:
+                    self._write_holder()
+            except:
+                os.close(self._fd)
+                self._fd = None
+                raise
+
+            stats.acquired += 1
+            stats.wait.add(self._acquired_at - start)
+            stats.holders.append(self)
 
         logger.debug('lock has been acquired')
         self._locked = True
@@ -579,16 +1162,132 @@ class MoulinetteLock(object):
     def release(self):
         """Release the lock of the moulinette instance
 
-        It will delete the lock file if the lock has been acquired.
+        It will unlock the lock file if the lock has been acquired.
 
         """
         if self._locked:
             if not self._bypass:
-                os.unlink(self._lockfile)
+                if not self.shared:
+                    try:
+                        os.ftruncate(self._fd, 0)
+                    except OSError:
+                        pass
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+
+                stats = self._get_stats(self.namespace)
+                stats.hold.add(time.time() - self._acquired_at)
+                stats.holders.remove(self)
 
             logger.debug('lock has been released')
             self._locked = False
 
+    @staticmethod
+    def get_holder(namespace):
+        """Return information about the holder of a namespace lock
+
+        Keyword arguments:
+            - namespace -- The namespace of the lock
+
+        The lock file is probed with a shared lock first, since the
+        information of an exclusive holder which has died is left in it.
+
+        Returns:
+            A dict of the holder's 'pid', 'action', 'action_id' and
+            acquisition time as 'since', or None if the lock is not held
+            exclusively
+
+        """
+        try:
+            with open('/var/run/moulinette_%s.lock' % namespace) as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                else:
+                    # Not held exclusively, closing the file unlocks it
+                    return None
+                return json.loads(f.read()) or None
+        except (IOError, ValueError):
+            return None
+
+    @classmethod
+    def get_stats(klass, namespace=None):
+        """Return contention statistics of namespace locks
+
+        Statistics are collected for the locks acquired in this process.
+        For each namespace, they consist of the number of 'acquired'
+        locks, 'contended' acquisitions - which had to wait - and
+        'timeouts', the distributions of the 'wait' and 'hold' durations
+        as returned by Histogram.as_dict, the current 'holders' in this
+        process and the exclusive 'holder' from the lock file.
+
+        Keyword arguments:
+            - namespace -- The namespace to return statistics for, or
+                None for all of them
+
+        Returns:
+            A dict of statistics or, if 'namespace' is None, a dict of
+            them for each namespace
+
+        """
+        if namespace is not None:
+            stats = klass._get_stats(namespace).as_dict()
+            stats['holder'] = klass.get_holder(namespace)
+            return stats
+        return dict([(n, klass.get_stats(n)) for n in klass._stats.keys()])
+
+    @staticmethod
+    def merge_stats(stats):
+        """Merge contention statistics of several processes
+
+        Keyword arguments:
+            - stats -- A list of statistics of all namespaces as returned
+                by get_stats, e.g. for each process
+
+        Returns:
+            A dict of statistics for each namespace, where counters and
+            distributions are summed and current holders are listed
+
+        """
+        merged = {}
+        for s in stats:
+            for n, ns in s.items():
+                m = merged.get(n)
+                if m is None:
+                    merged[n] = ns
+                    continue
+                merged[n] = {
+                    'acquired': m['acquired'] + ns['acquired'],
+                    'contended': m['contended'] + ns['contended'],
+                    'timeouts': m['timeouts'] + ns['timeouts'],
+                    'wait': Histogram.merge(m['wait'], ns['wait']),
+                    'hold': Histogram.merge(m['hold'], ns['hold']),
+                    'holders': m['holders'] + ns['holders'],
+                    'holder': m['holder'] or ns['holder'],
+                }
+        return merged
+
+    @classmethod
+    def reset_stats(klass):
+        """Reset contention statistics, except current holders"""
+        for n, stats in klass._stats.items():
+            holders = stats.holders
+            stats = klass._stats[n] = _LockStats()
+            stats.holders = holders
+
+    def get_info(self):
+        """Return the holder's information of this lock"""
+        return {
+            'pid': os.getpid(),
+            'action': self.action,
+            'action_id': self.action_id,
+            'shared': self.shared,
+            'since': getattr(self, '_acquired_at', None),
+        }
+
     def __enter__(self):
         if not self._locked:
             self.acquire()
@@ -599,3 +1298,113 @@ class MoulinetteLock(object):
 
     def __del__(self):
         self.release()
+
+
+    ## Private methods
+
+    def _flock(self, flags=0):
+        """Lock the lock file and return True if it has been locked"""
+        try:
+            fcntl.flock(self._fd, flags | (fcntl.LOCK_SH if self.shared
+                                           else fcntl.LOCK_EX))
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES, errno.EINTR):
+                raise
+            return False
+        return True
+
+    def _try(self):
+        """Try to lock the lock file without waiting"""
+        return self._flock(fcntl.LOCK_NB)
+
+    def _wait(self, timeout):
+        """Wait until the lock is acquired or the timeout expires"""
+        if timeout is None:
+            return self._flock()
+        elif timeout <= 0:
+            return False
+
+        # Block until the lock is released or an alarm interrupts it
+        def _expired(signum, frame):
+            raise _LockTimeout()
+        try:
+            handler = signal.signal(signal.SIGALRM, _expired)
+        except ValueError:
+            # Not in the main thread, no alarm can be used
+            return self._wait_in_thread(timeout)
+        try:
+            try:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+                return self._flock()
+            finally:
+                try:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                finally:
+                    signal.signal(signal.SIGALRM, handler or signal.SIG_DFL)
+        except _LockTimeout:
+            return False
+
+    def _wait_in_thread(self, timeout):
+        """Wait until the lock is acquired by a helper thread or the
+        timeout expires
+
+        The helper thread blocks on its own descriptor of the lock file,
+        so that it is queued by the kernel as other waiters are. If the
+        timeout expires, it is abandoned and releases the lock as soon
+        as it gets it. Otherwise, its descriptor replaces this one.
+
+        """
+        fd = os.open(self._lockfile, os.O_RDWR)
+        acquired = threading.Event()
+        state = {'abandoned': False, 'locked': False}
+        state_lock = threading.Lock()
+
+        def _lock():
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH if self.shared
+                                else fcntl.LOCK_EX)
+                locked = True
+            except IOError:
+                locked = False
+            with state_lock:
+                if state['abandoned']:
+                    # Closing the descriptor releases the lock
+                    os.close(fd)
+                    return
+                state['locked'] = locked
+                acquired.set()
+
+        helper = threading.Thread(target=_lock,
+                                  name='lock-%s' % self.namespace)
+        helper.daemon = True
+        helper.start()
+
+        acquired.wait(timeout)
+        with state_lock:
+            if not acquired.is_set():
+                state['abandoned'] = True
+                return False
+        if not state['locked']:
+            os.close(fd)
+            return False
+
+        # The descriptor of this lock doesn't hold it
+        os.close(self._fd)
+        self._fd = fd
+        return True
+
+    @classmethod
+    def _get_stats(klass, namespace):
+        """Return the _LockStats of a namespace"""
+        try:
+            return klass._stats[namespace]
+        except KeyError:
+            stats = klass._stats[namespace] = _LockStats()
+            return stats
+
+    def _write_holder(self):
+        """Write the holder's information to the lock file"""
+        holder = json.dumps(self.get_info())
+        os.ftruncate(self._fd, 0)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, holder)
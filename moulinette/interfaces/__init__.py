@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import os
 import sys
 import errno
 import logging
@@ -15,6 +14,9 @@ GLOBAL_SECTION = '_global'
 TO_RETURN_PROP = '_to_return'
 CALLBACKS_PROP = '_callbacks'
 
+# Lock modes of an action
+LOCK_MODES = ('shared', 'exclusive', 'none')
+
 
 # Base Class -----------------------------------------------------------
 
@@ -103,7 +105,10 @@ class BaseActionsMapParser(object):
     def add_action_parser(self, name, tid, **kwargs):
         """Add a parser for an action
 
-        Create a new action and return an argument parser for it.
+        Create a new action and return an argument parser for it. If
+        the returned object provides a 'set_loader' method, it will be
+        given a callable which adds the action arguments to the parser
+        passed as argument, so that it can be deferred.
 
         Keyword arguments:
             - name -- The action name
@@ -132,6 +137,26 @@ class BaseActionsMapParser(object):
         raise NotImplementedError("derived class '%s' must override this method" % \
                                       self.__class__.__name__)
 
+    def filter_actions(self, args, categories):
+        """Filter actions needed to parse arguments
+
+        Return the actions whose parsers are needed to parse 'args', so
+        that only them are constructed. It is called once the global
+        configuration and arguments have been set. Derived classes can
+        override this method, the default is to need all actions.
+
+        Keyword arguments:
+            - args -- The list of argument strings to parse
+            - categories -- A dict of the list of action names for each
+                category name
+
+        Returns:
+            A list of (category, action) names or None if all actions
+            are needed
+
+        """
+        return None
+
 
     ## Arguments helpers
 
@@ -149,10 +174,6 @@ class BaseActionsMapParser(object):
             namespace = argparse.Namespace()
         namespace._tid = tid
 
-        # Check lock
-        if not self.get_conf(tid, 'lock'):
-            os.environ['BYPASS_LOCK'] = 'yes'
-
         # Perform authentication if needed
         if self.get_conf(tid, 'authenticate'):
             auth_conf, cls = self.get_conf(tid, 'authenticator')
@@ -327,10 +348,42 @@ class BaseActionsMapParser(object):
             pass
         else:
             if isinstance(lock, bool):
+                # Deprecated boolean value
+                conf['lock'] = 'exclusive' if lock else 'none'
+            elif lock in LOCK_MODES:
                 conf['lock'] = lock
             else:
-                logger.error("expecting a boolean for configuration 'lock', " \
-                             "got %r", lock)
+                logger.error("expecting 'shared', 'exclusive', 'none' or a " \
+                             "boolean for configuration 'lock', got %r", lock)
+                raise MoulinetteError(errno.EINVAL, m18n.g('error_see_log'))
+
+        # -- 'lock_timeout'
+        try:
+            timeout = configuration['lock_timeout']
+        except KeyError:
+            pass
+        else:
+            if timeout is None or (isinstance(timeout, (int, float)) and
+                    not isinstance(timeout, bool) and timeout >= 0):
+                conf['lock_timeout'] = timeout
+            else:
+                logger.error("expecting a positive number or null for " \
+                             "configuration 'lock_timeout', got %r", timeout)
+                raise MoulinetteError(errno.EINVAL, m18n.g('error_see_log'))
+
+        # -- 'max_concurrency'
+        try:
+            limit = configuration['max_concurrency']
+        except KeyError:
+            pass
+        else:
+            if limit is None or (isinstance(limit, int) and
+                    not isinstance(limit, bool) and limit > 0):
+                conf['max_concurrency'] = limit
+            else:
+                logger.error("expecting a strictly positive integer or null " \
+                             "for configuration 'max_concurrency', got %r",
+                             limit)
                 raise MoulinetteError(errno.EINVAL, m18n.g('error_see_log'))
 
         return conf
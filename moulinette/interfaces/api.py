@@ -2,22 +2,35 @@
 
 import os
 import re
+import sys
+import fcntl
 import errno
+import signal
+import select
 import argparse
-from json import dumps as json_encode
+import threading
+from json import dumps as json_encode, loads as json_decode
+from time import time, sleep as thread_sleep
+from Queue import Empty, Queue as ThreadQueue
 
-from gevent import sleep
+from gevent import sleep, spawn
+from gevent.local import local
 from gevent.queue import Queue
-from geventwebsocket import WebSocketError
 
 from bottle import run, request, response, Bottle, HTTPResponse
 
-from moulinette.core import MoulinetteError, clean_session
+from moulinette.core import (
+    MoulinetteError, MoulinetteLock, clean_session, sweep_sessions,
+)
+from moulinette.authenticators import AuthenticatorPool
 from moulinette.interfaces import (
     BaseActionsMapParser, BaseInterface, ExtendedArgumentParser,
 )
 from moulinette.utils import log
 from moulinette.utils.serialize import JSONExtendedEncoder
+from moulinette.utils.session import (
+    MemorySessionStore, FileSessionStore, is_valid_session_id,
+)
 from moulinette.utils.text import random_ascii
 
 logger = log.getLogger('moulinette.interface.api')
@@ -25,9 +38,158 @@ logger = log.getLogger('moulinette.interface.api')
 
 # API helpers ----------------------------------------------------------
 
+"""The time period between sweeps of expired sessions"""
+SESSION_SWEEP_INTERVAL = 60
+
+"""The default time period after which an unused session expires and
+maximum number of sessions kept in memory"""
+SESSION_TTL = 3600
+SESSION_MAXSIZE = 1000
+
+"""The default time period to wait for the lock of a namespace"""
+LOCK_TIMEOUT = 30
+
 class LogQueues(dict):
     """Map of session id to queue."""
-    pass
+
+    def open(self, sid):
+        """Return the queue of a session, which is created if needed"""
+        try:
+            return self[sid]
+        except KeyError:
+            queue = self[sid] = Queue()
+            return queue
+
+class _SpoolQueue(object):
+    """Queue of messages stored in a spool file
+
+    Messages are appended to the file as JSON lines, so that they can be
+    put from any process. They are retrieved by polling the file for new
+    lines cooperatively. Messages put while the file doesn't exist - i.e.
+    no one listens to the queue - are dropped.
+
+    Keyword arguments:
+        - path -- The path to the spool file
+        - interval -- The time period between checks for new messages
+
+    """
+    def __init__(self, path, interval=.1):
+        self.path = path
+        self.interval = interval
+        self._offset = 0
+        self._pending = []
+
+    def put_nowait(self, item):
+        line = json_encode(None if item is StopIteration else item) + '\n'
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError:
+            return
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    put = put_nowait
+
+    def get(self):
+        while not self._pending:
+            try:
+                with open(self.path) as f:
+                    f.seek(self._offset)
+                    data = f.read()
+            except IOError:
+                # The queue has been deleted
+                return StopIteration
+            # Retrieve complete lines only
+            data = data[:data.rfind('\n') + 1]
+            if not data:
+                sleep(self.interval)
+                continue
+            self._offset += len(data)
+            self._pending = [json_decode(l) for l in data.splitlines()]
+        item = self._pending.pop(0)
+        return StopIteration if item is None else tuple(item)
+
+class SpoolLogQueues(LogQueues):
+    """Map of session id to queue shared between processes
+
+    The queue of a session is a spool file in the given directory, so
+    that the messages of an action processed by a server process are
+    sent to the session WebSocket served by another one.
+
+    Keyword arguments:
+        - path -- The directory where spool files are stored
+
+    """
+    def __init__(self, path):
+        super(SpoolLogQueues, self).__init__()
+        self.path = path
+
+    def _get_path(self, sid):
+        if not is_valid_session_id(sid):
+            raise KeyError(sid)
+        return os.path.join(self.path, sid)
+
+    def __contains__(self, sid):
+        try:
+            return os.path.exists(self._get_path(sid))
+        except KeyError:
+            return False
+
+    def __getitem__(self, sid):
+        path = self._get_path(sid)
+        if not os.path.exists(path):
+            raise KeyError(sid)
+        return _SpoolQueue(path)
+
+    def __setitem__(self, sid, queue):
+        open(self._get_path(sid), 'w').close()
+
+    def __delitem__(self, sid):
+        try:
+            os.unlink(self._get_path(sid))
+        except OSError:
+            raise KeyError(sid)
+
+    def open(self, sid):
+        path = self._get_path(sid)
+        # Start from the end of a spool file which is already listened
+        queue = _SpoolQueue(path)
+        with open(path, 'a') as f:
+            queue._offset = f.tell()
+        return queue
+
+    def clear(self):
+        for f in os.listdir(self.path):
+            os.unlink(os.path.join(self.path, f))
+
+def _is_process_alive(pid):
+    """Return True if a process is running"""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+# Context of the current worker thread of an ActionsPool
+_worker = threading.local()
+
+def _put_message(queue, message):
+    """Put a message in a session queue
+
+    The message is put directly in the queue from the gevent loop, and
+    is relayed by the waiting greenlet from a worker thread of an
+    ActionsPool - since gevent queues are not thread-safe.
+
+    """
+    relay = getattr(_worker, 'relay', None)
+    if relay is not None:
+        relay.put((queue, message))
+    else:
+        queue.put_nowait(message)
+        # Put the current greenlet to sleep for 0 second in order to
+        # populate the new message in the queue
+        sleep(0)
 
 class APIQueueHandler(log.Handler):
     """
@@ -47,36 +209,182 @@ class APIQueueHandler(log.Handler):
             return
         else:
             # Put the message as a 2-tuple in the queue
-            queue.put_nowait((record.levelname.lower(), record.getMessage()))
-            # Put the current greenlet to sleep for 0 second in order to
-            # populate the new message in the queue
-            sleep(0)
+            _put_message(queue,
+                         (record.levelname.lower(), record.getMessage()))
+
+class CooperativeLock(MoulinetteLock):
+    """Lock which waits cooperatively with other greenlets
+
+    The lock file is tried again periodically while the current greenlet
+    sleeps, so that other requests are served meanwhile - or while the
+    current thread sleeps in a worker thread of an ActionsPool. Waiters
+    of the server are queued per namespace and the lock is only tried by
+    the first one, a new request being queued behind them. Each waiter
+    is informed of its position in the queue by the 'display' signal
+    when it changes.
+
+    See MoulinetteLock for keyword arguments.
+
+    """
+    _queues = {}
+
+    def _try(self):
+        if self._queues.get(self.namespace):
+            # Don't take the lock ahead of queued waiters
+            return False
+        return super(CooperativeLock, self)._try()
+
+    def _wait(self, timeout):
+        if timeout is not None and timeout <= 0:
+            return False
+        deadline = None if timeout is None else time() + timeout
+        if getattr(_worker, 'relay', None) is not None:
+            _sleep = thread_sleep
+        else:
+            _sleep = sleep
+
+        queue = self._queues.setdefault(self.namespace, [])
+        queue.append(self)
+        position = None
+        try:
+            while deadline is None or time() < deadline:
+                if queue.index(self) + 1 != position:
+                    position = queue.index(self) + 1
+                    msignals.display(m18n.g('lock_waiting', position),
+                                     'warning')
+                _sleep(self.interval)
+                if queue[0] is self and self._flock(fcntl.LOCK_NB):
+                    return True
+            return False
+        finally:
+            queue.remove(self)
+
+class ActionsPool(object):
+    """Pool of threads to process actions out of the gevent loop
+
+    An action is run in a worker thread while the request greenlet waits
+    for its result cooperatively, so that the server keeps serving other
+    requests while it blocks. The request and the locale are set in the
+    worker, and messages which are displayed or logged for the session
+    are relayed to its queue by the waiting greenlet. The threads are
+    created on the first call in each process, since a pool which
+    exists before a fork does not run tasks in the child process.
+
+    Keyword arguments:
+        - size -- The maximum number of worker threads
+        - interval -- The time period between relays of messages
+
+    """
+    def __init__(self, size, interval=.1):
+        self.size = size
+        self.interval = interval
+        self._pool = None
+        self._pid = None
+
+    @property
+    def pool(self):
+        """Return the thread pool of the current process"""
+        if self._pool is None or self._pid != os.getpid():
+            from gevent.threadpool import ThreadPool
+
+            self._pool = ThreadPool(self.size)
+            self._pid = os.getpid()
+        return self._pool
+
+    def apply(self, func, args=(), kwargs={}):
+        """Call a function in a worker thread and return its result
+
+        Keyword arguments:
+            - func -- The function to call
+            - args -- A tuple of positional arguments
+            - kwargs -- A dict of keyword arguments
+
+        """
+        relay = ThreadQueue()
+        result = self.pool.spawn(self._run, func, args, kwargs,
+                                  request.environ.copy(), m18n.locale, relay)
+        while not result.ready():
+            result.wait(self.interval)
+            self._relay(relay)
+        self._relay(relay)
+
+        ret, exc_info = result.get()
+        if exc_info is not None:
+            # Raise the exception of the worker in the request greenlet
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return ret
+
+    @staticmethod
+    def _run(func, args, kwargs, environ, locale, relay):
+        """Call the function and return a 2-tuple (result, exc_info), so
+        that exceptions are not reported by the thread pool"""
+        # Bind the request and set the locale of the greenlet
+        request.bind(environ)
+        m18n.set_locale(locale)
+        _worker.relay = relay
+        try:
+            return (func(*args, **kwargs), None)
+        except Exception:
+            return (None, sys.exc_info())
+        finally:
+            _worker.relay = None
+
+    @staticmethod
+    def _relay(relay):
+        while True:
+            try:
+                queue, message = relay.get_nowait()
+            except Empty:
+                return
+            queue.put_nowait(message)
 
 class _HTTPArgumentParser(object):
     """Argument parser for HTTP requests
 
     Object for parsing HTTP requests into Python objects. It is based
     on ExtendedArgumentParser class and implements some of its methods.
+    The ExtendedArgumentParser object is only initialized when needed,
+    and arguments can be added at this time by a loader.
 
     """
+    # Lock held while a parser is initialized, which is shared by all
+    # parsers and reentrant since the loader uses the parser
+    _init_lock = threading.RLock()
+
     def __init__(self):
-        # Initialize the ArgumentParser object
-        self._parser = ExtendedArgumentParser(usage='',
-                                              prefix_chars='@',
-                                              add_help=False)
-        self._parser.error = self._error
+        self._parser = None
+        self._loader = None
+        self._initialized = False
+        self._defaults = {}
 
         self._positional = []   # list(arg_name)
         self._optional = {}     # dict({arg_name: option_strings})
 
+    @property
+    def parser(self):
+        """Return the ExtendedArgumentParser object"""
+        if not self._initialized:
+            with self._init_lock:
+                # The parser is being initialized by this thread if set
+                if self._parser is None:
+                    self._initialize()
+        return self._parser
+
+    def set_loader(self, loader):
+        """Set a callable which adds arguments to the parser given as
+        argument once initialized"""
+        self._loader = loader
+
     def set_defaults(self, **kwargs):
-        return self._parser.set_defaults(**kwargs)
+        self._defaults.update(kwargs)
+        if self._parser is not None:
+            self._parser.set_defaults(**kwargs)
 
     def get_default(self, dest):
-        return self._parser.get_default(dest)
+        return self.parser.get_default(dest)
 
     def add_argument(self, *args, **kwargs):
-        action = self._parser.add_argument(*args, **kwargs)
+        action = self.parser.add_argument(*args, **kwargs)
 
         # Append newly created action
         if len(action.option_strings) == 0:
@@ -87,6 +395,7 @@ class _HTTPArgumentParser(object):
         return action
 
     def parse_args(self, args={}, namespace=None):
+        parser = self.parser
         arg_strings = []
 
         ## Append an argument to the current one
@@ -129,10 +438,30 @@ class _HTTPArgumentParser(object):
             if dest in args:
                 arg_strings = append(arg_strings, args[dest], opt[0])
 
-        return self._parser.parse_args(arg_strings, namespace)
+        return parser.parse_args(arg_strings, namespace)
 
     def dequeue_callbacks(self, *args, **kwargs):
-        return self._parser.dequeue_callbacks(*args, **kwargs)
+        return self.parser.dequeue_callbacks(*args, **kwargs)
+
+    def _initialize(self):
+        # Initialize the ArgumentParser object
+        self._parser = ExtendedArgumentParser(usage='',
+                                              prefix_chars='@',
+                                              add_help=False)
+        self._parser.error = self._error
+        self._parser.set_defaults(**self._defaults)
+
+        if self._loader is not None:
+            try:
+                self._loader(self)
+            except:
+                # Initialize it again on next call
+                self._parser = None
+                self._positional = []
+                self._optional = {}
+                raise
+            self._loader = None
+        self._initialized = True
 
     def _error(self, message):
         # TODO: Raise a proper exception
@@ -148,12 +477,23 @@ class _ActionsMapPlugin(object):
         - actionsmap -- An ActionsMap instance
         - use_websocket -- If true, install a WebSocket on /messages in order
             to serve messages coming from the 'display' signal
+        - lock_timeout -- The default time period to wait for the lock of
+            a namespace, None to wait indefinitely
+        - pool -- An ActionsPool to process actions with, or None to
+            process them in the request greenlet
+        - secrets -- A SessionStore of the session secrets, in memory by
+            default
+        - stats_path -- A directory where the locks statistics of each
+            server process are written, so that they are merged, or None
+            if there is only one process
 
     """
     name = 'actionsmap'
     api = 2
 
-    def __init__(self, actionsmap, use_websocket, log_queues={}):
+    def __init__(self, actionsmap, use_websocket, log_queues=None,
+                 lock_timeout=LOCK_TIMEOUT, pool=None, secrets=None,
+                 stats_path=None):
         # Connect signals to handlers
         msignals.set_handler('authenticate', self._do_authenticate)
         if use_websocket:
@@ -161,9 +501,17 @@ class _ActionsMapPlugin(object):
 
         self.actionsmap = actionsmap
         self.use_websocket = use_websocket
-        self.log_queues = log_queues
-        # TODO: Save and load secrets?
-        self.secrets = {}
+        self.log_queues = log_queues if log_queues is not None \
+            else LogQueues()
+        self.lock_timeout = lock_timeout
+        self.pool = pool
+        self.secrets = secrets if secrets is not None \
+            else MemorySessionStore()
+        self.authenticators = AuthenticatorPool()
+        self.stats_path = stats_path
+
+        # Semaphores of the routes with a concurrency limit
+        self._semaphores = {}
 
     def setup(self, app):
         """Setup plugin on the application
@@ -206,6 +554,12 @@ class _ActionsMapPlugin(object):
         app.route('/logout', name='logout', method='GET',
                   callback=self.logout, skip=['actionsmap'], apply=_logout)
 
+        # Append locks and translations statistics routes
+        app.route('/locks', name='locks', method='GET',
+                  callback=self.locks, skip=['actionsmap'])
+        app.route('/translations', name='translations', method='GET',
+                  callback=self.translations, skip=['actionsmap'])
+
         # Append messages route
         if self.use_websocket:
             app.route('/messages', name='messages',
@@ -215,6 +569,15 @@ class _ActionsMapPlugin(object):
         for (m, p) in self.actionsmap.parser.routes:
             app.route(p, method=m, callback=self.process)
 
+            try:
+                limit = self.actionsmap.parser.get_route_conf(
+                    (m, p), 'max_concurrency')
+            except KeyError:
+                limit = None
+            if limit is not None:
+                from gevent.lock import BoundedSemaphore
+                self._semaphores[(m, p)] = BoundedSemaphore(limit)
+
     def apply(self, callback, context):
         """Apply plugin to the route callback
 
@@ -274,7 +637,9 @@ class _ActionsMapPlugin(object):
 
         """
         # Retrieve session values
-        s_id = request.get_cookie('session.id') or random_ascii()
+        s_id = request.get_cookie('session.id')
+        if not is_valid_session_id(s_id):
+            s_id = random_ascii()
         try:
             s_secret = self.secrets[s_id]
         except KeyError:
@@ -288,6 +653,7 @@ class _ActionsMapPlugin(object):
             # Attempt to authenticate
             auth = self.actionsmap.get_authenticator(profile)
             auth(password, token=(s_id, s_hash))
+            self.authenticators.release(s_id, profile, s_hash, auth)
         except MoulinetteError as e:
             if len(s_hashes) > 0:
                 try: self.logout(profile)
@@ -315,16 +681,61 @@ class _ActionsMapPlugin(object):
         """
         s_id = request.get_cookie('session.id')
         try:
+            s_secret = self.secrets[s_id]
             del self.secrets[s_id]
         except KeyError:
             raise HTTPUnauthorizedResponse(m18n.g('not_logged_in'))
         else:
-            # TODO: Clean the session for profile only
-            # Delete cookie and clean the session
+            self.authenticators.evict(s_id)
+            s_hashes = request.get_cookie('session.hashes',
+                                          secret=s_secret) or {}
+
+            # Delete cookie and clean the session of all its profiles,
+            # since its secret is not valid anymore
             response.set_cookie('session.hashes', '', max_age=-1)
-            clean_session(s_id)
+            clean_session(s_id, s_hashes.keys())
         return m18n.g('logged_out')
 
+    def locks(self):
+        """Return contention statistics of namespace locks
+
+        Return the statistics of MoulinetteLock.get_stats for the locks
+        acquired by the server - merged for all server processes. The
+        session must be logged in.
+
+        """
+        if request.get_cookie('session.id') not in self.secrets:
+            raise HTTPUnauthorizedResponse(m18n.g('not_logged_in'))
+        if self.stats_path is None:
+            return MoulinetteLock.get_stats()
+
+        stats = [MoulinetteLock.get_stats()]
+        for f in os.listdir(self.stats_path):
+            if not f.endswith('.json') or f[:-5] == str(os.getpid()):
+                continue
+            try:
+                with open(os.path.join(self.stats_path, f)) as fp:
+                    s = json_decode(fp.read())
+            except (IOError, ValueError):
+                continue
+            if not _is_process_alive(int(f[:-5])):
+                # Keep the statistics of a process which has exited
+                for ns in s.values():
+                    ns['holders'] = []
+            stats.append(s)
+        return MoulinetteLock.merge_stats(stats)
+
+    def translations(self):
+        """Return counters of keys which are not translated
+
+        Return the statistics of Moulinette18n.get_stats for the keys
+        translated by the server. The session must be logged in.
+
+        """
+        if request.get_cookie('session.id') not in self.secrets:
+            raise HTTPUnauthorizedResponse(m18n.g('not_logged_in'))
+        return m18n.get_stats()
+
     def messages(self):
         """Listen to the messages WebSocket stream
 
@@ -335,15 +746,15 @@ class _ActionsMapPlugin(object):
         """
         s_id = request.get_cookie('session.id')
         try:
-            queue = self.log_queues[s_id]
+            queue = self._open_queue(s_id)
         except KeyError:
-            # Create a new queue for the session
-            queue = Queue()
-            self.log_queues[s_id] = queue
+            # There are no messages for an invalid session
+            return
 
         wsock = request.environ.get('wsgi.websocket')
         if not wsock:
             raise HTTPErrorResponse(m18n.g('websocket_request_expected'))
+        from geventwebsocket import WebSocketError
 
         while True:
             item = queue.get()
@@ -353,7 +764,10 @@ class _ActionsMapPlugin(object):
             except TypeError:
                 if item == StopIteration:
                     # Delete the current queue and break
-                    del self.log_queues[s_id]
+                    try:
+                        del self.log_queues[s_id]
+                    except KeyError:
+                        pass
                     break
                 logger.exception("invalid item in the messages queue: %r", item)
             else:
@@ -369,15 +783,32 @@ class _ActionsMapPlugin(object):
 
         Call the actions map in order to process the relevant action for
         the route with the given arguments and process the returned
-        value.
+        value. If the route has a concurrency limit, the request waits
+        cooperatively for a slot first.
 
         Keyword arguments:
             - _route -- The action route as a 2-tuple (method, path)
             - arguments -- A dict of arguments for the route
 
         """
+        semaphore = self._semaphores.get(_route)
+        if semaphore is not None:
+            semaphore.acquire()
+
+        # Authenticators used by the request, to put back in the pool
+        acquired = request.environ['moulinette.authenticators'] = []
         try:
-            ret = self.actionsmap.process(arguments, route=_route)
+            if self.pool is not None:
+                # The namespace lock is waited for in the worker thread
+                ret = self.pool.apply(self.actionsmap.process, (arguments,),
+                                      {'timeout': self.lock_timeout,
+                                       'lock_class': CooperativeLock,
+                                       'route': _route})
+            else:
+                ret = self.actionsmap.process(arguments,
+                                              timeout=self.lock_timeout,
+                                              lock_class=CooperativeLock,
+                                              route=_route)
         except MoulinetteError as e:
             raise error_to_response(e)
         else:
@@ -390,6 +821,61 @@ class _ActionsMapPlugin(object):
                 pass
             else:
                 queue.put(StopIteration)
+            for a in acquired:
+                self.authenticators.release(*a)
+            if semaphore is not None:
+                semaphore.release()
+            if self.stats_path is not None:
+                self._write_stats()
+
+
+    ## Statistics
+
+    def _write_stats(self):
+        """Write the locks statistics of this process"""
+        import tempfile
+
+        fd, tmp_file = tempfile.mkstemp(prefix='.', dir=self.stats_path)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json_encode(MoulinetteLock.get_stats()))
+            os.rename(tmp_file, os.path.join(self.stats_path,
+                                             '%d.json' % os.getpid()))
+        except EnvironmentError:
+            logger.warning("unable to write locks statistics", exc_info=1)
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+
+
+    ## Sessions
+
+    def _open_queue(self, s_id):
+        """Return the messages queue of a session, created if needed"""
+        if isinstance(self.log_queues, LogQueues):
+            return self.log_queues.open(s_id)
+        try:
+            return self.log_queues[s_id]
+        except KeyError:
+            queue = self.log_queues[s_id] = Queue()
+            return queue
+
+    def sweep_sessions(self):
+        """Remove expired sessions
+
+        Remove the expired secrets, their authenticators and the session
+        files of sessions which have no secret anymore. Authenticators
+        which have not been used recently are closed too.
+
+        """
+        expired = self.secrets.sweep()
+        if expired:
+            logger.debug("%d expired sessions removed", len(expired))
+        for s_id in expired:
+            self.authenticators.evict(s_id)
+        self.authenticators.sweep()
+        sweep_sessions(lambda s_id: s_id in self.secrets)
 
 
     ## Signals handlers
@@ -412,8 +898,17 @@ class _ActionsMapPlugin(object):
                 msg = m18n.g('authentication_profile_required',
                              authenticator.name)
             raise HTTPUnauthorizedResponse(msg)
-        else:
-            return authenticator(token=(s_id, s_hash))
+
+        # Reuse the authenticator of the session if possible
+        auth = self.authenticators.acquire(s_id, authenticator.name, s_hash)
+        if auth is None:
+            auth = authenticator(token=(s_id, s_hash))
+        try:
+            request.environ['moulinette.authenticators'].append(
+                (s_id, auth.name, s_hash, auth))
+        except KeyError:
+            pass
+        return auth
 
     def _do_display(self, message, style):
         """Display a message
@@ -428,11 +923,7 @@ class _ActionsMapPlugin(object):
             return
 
         # Put the message as a 2-tuple in the queue
-        queue.put_nowait((style, message))
-
-        # Put the current greenlet to sleep for 0 second in order to
-        # populate the new message in the queue
-        sleep(0)
+        _put_message(queue, (style, message))
 
 
 # HTTP Responses -------------------------------------------------------
@@ -494,6 +985,255 @@ def format_for_response(content):
     return json_encode(content, cls=JSONExtendedEncoder)
 
 
+# Pre-fork server ------------------------------------------------------
+
+"""The maximum time period to wait before spawning a worker again after
+workers have failed"""
+RESPAWN_MAX_DELAY = 30
+
+class PreforkServer(object):
+    """Pre-forking server for a WSGI application
+
+    Bind the listening socket, then fork worker processes which accept
+    connections on it and serve the application with a gevent WSGI
+    server - so that everything loaded before is shared with them.
+    Workers are supervised and spawned again when they exit - after a
+    delay which increases while they keep failing. Each one
+    reports periodically to the master through a pipe from a native
+    thread while its loop is running or a request is processed, so that
+    a worker whose loop is blocked for too long out of a request is
+    killed.
+
+    Keyword arguments:
+        - app -- The WSGI application
+        - host -- Server address to bind to
+        - port -- Server port to bind to
+        - processes -- The number of worker processes
+        - handler_class -- The WSGIHandler class of the servers
+        - max_requests -- The number of requests after which a worker is
+            replaced, 0 to never replace it - it stops accepting
+            connections and exits once the requests being processed are
+            done, or after 'timeout'
+        - timeout -- The time period after which a worker which doesn't
+            report is killed, None to only restart exited workers
+        - post_fork -- A callable to call in each worker process before
+            it serves requests
+
+    """
+    def __init__(self, app, host, port, processes, handler_class=None,
+                 max_requests=0, timeout=None, post_fork=None):
+        self.app = app
+        self.address = (host, port)
+        self.processes = processes
+        self.handler_class = handler_class
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.post_fork = post_fork
+        self.interval = 1
+
+        self._listener = None
+        # dict({pid: [report fd, last report time or None once it exits,
+        #             spawn time]})
+        self._workers = {}
+        self._stopping = False
+        self._failures = 0
+        self._respawn_at = 0
+
+    def serve_forever(self):
+        """Serve the application until the master is interrupted"""
+        import gc
+        from gevent import socket
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(self.address)
+        self._listener.listen(socket.SOMAXCONN)
+
+        # Collect garbage once for all workers
+        gc.collect()
+
+        def _stop(signum, frame):
+            self._stopping = True
+        signal.signal(signal.SIGTERM, _stop)
+
+        try:
+            while not self._stopping:
+                while len(self._workers) < self.processes and \
+                        time() >= self._respawn_at:
+                    self._spawn_worker()
+                self._supervise()
+        finally:
+            self._stopping = True
+            for pid in self._workers.keys():
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            while self._workers:
+                try:
+                    self._reap(os.waitpid(-1, 0)[0])
+                except OSError:
+                    break
+
+    def _spawn_worker(self):
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid != 0:
+            os.close(wfd)
+            self._workers[pid] = [rfd, time(), time()]
+            logger.debug("server worker %d spawned", pid)
+            return
+
+        # -- Worker process
+        status = 0
+        try:
+            os.close(rfd)
+            for w in self._workers.values():
+                os.close(w[0])
+            self._workers = {}
+            self._serve(wfd)
+        except:
+            logger.exception("server worker %d failed", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _serve(self, report_fd):
+        import gevent
+        from gevent.monkey import get_original
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+
+        gevent.reinit()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.post_fork is not None:
+            self.post_fork()
+
+        kwargs = {}
+        if self.handler_class is not None:
+            kwargs['handler_class'] = self.handler_class
+        # Keep track of handlers to let them finish when stopping
+        server = WSGIServer(self._listener, self._wrap_app(), spawn=Pool(),
+                            **kwargs)
+        server.stop_timeout = self.timeout
+        self._server = server
+        self._active = 0
+        self._ticks = 0
+
+        ## Count the iterations of the loop
+        def _tick():
+            while True:
+                self._ticks += 1
+                sleep(self.interval)
+        gevent.spawn(_tick)
+
+        # Report from a native thread, so that it is not prevented by a
+        # request which blocks the loop
+        start_new_thread = get_original('thread', 'start_new_thread')
+        start_new_thread(self._report, (report_fd,))
+
+        server.serve_forever()
+
+    def _report(self, report_fd):
+        """Report to the master while the loop is running or a request
+        is processed"""
+        from gevent.monkey import get_original
+
+        _sleep = get_original('time', 'sleep')
+        ticks = None
+        while True:
+            if self._active or self._ticks != ticks:
+                ticks = self._ticks
+                try:
+                    os.write(report_fd, '.')
+                except OSError:
+                    return
+            _sleep(self.interval)
+
+    def _wrap_app(self):
+        """Return the application which counts the requests being
+        processed and stops the worker server after the maximum number
+        of requests"""
+        count = [0]
+
+        def app(environ, start_response):
+            count[0] += 1
+            if count[0] == self.max_requests:
+                logger.debug("server worker %d recycled after %d requests",
+                             os.getpid(), count[0])
+                # Stop accepting connections, the server will be stopped
+                # once handlers are done
+                self._server.close()
+            self._active += 1
+            try:
+                return self.app(environ, start_response)
+            finally:
+                self._active -= 1
+        return app
+
+    def _supervise(self):
+        fds = dict([(w[0], w) for w in self._workers.values()
+                    if w[1] is not None])
+        try:
+            ready = select.select(fds.keys(), [], [], self.interval)[0]
+        except select.error:
+            # Interrupted by a signal
+            ready = []
+        now = time()
+        for fd in ready:
+            # The pipe is closed once the worker exits
+            fds[fd][1] = now if os.read(fd, 4096) else None
+
+        # Reap exited workers
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if pid == 0:
+                break
+            w = self._reap(pid)
+            if status != 0 and not self._stopping:
+                logger.warning("server worker %d exited with status %d",
+                               pid, status)
+                self._delay_respawn(w, now)
+
+        # Kill workers which don't report
+        if self.timeout is not None:
+            for pid, w in self._workers.items():
+                if w[1] is not None and now - w[1] > self.timeout:
+                    logger.warning("server worker %d is not responding, "
+                                   "killing it", pid)
+                    w[1] = None
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+
+    def _reap(self, pid):
+        try:
+            w = self._workers.pop(pid)
+        except KeyError:
+            return None
+        os.close(w[0])
+        return w
+
+    def _delay_respawn(self, worker, now):
+        """Delay the spawn of workers after a failure, twice as long as
+        the previous one if the worker failed soon after its spawn"""
+        if worker is not None and now - worker[2] < RESPAWN_MAX_DELAY:
+            self._failures += 1
+        else:
+            self._failures = 1
+        delay = min(self.interval * 2 ** (self._failures - 1),
+                    RESPAWN_MAX_DELAY)
+        self._respawn_at = now + delay
+        if self._failures > 1:
+            logger.warning("server workers are failing, waiting %ds "
+                           "before spawning them", delay)
+
+
 # API Classes Implementation -------------------------------------------
 
 class ActionsMapParser(BaseActionsMapParser):
@@ -575,6 +1315,16 @@ class ActionsMapParser(BaseActionsMapParser):
         # Return the created parser
         return parser
 
+    def get_route_conf(self, route, name):
+        """Get the value of the configuration of the action for a route
+
+        Keyword arguments:
+            - route -- The action route as a 2-tuple (method, path)
+            - name -- The configuration name
+
+        """
+        return self.get_conf(self._parsers[route][0], name)
+
     def parse_args(self, args, route, **kwargs):
         """Parse arguments
 
@@ -590,9 +1340,6 @@ class ActionsMapParser(BaseActionsMapParser):
             raise MoulinetteError(errno.EINVAL, m18n.g('error_see_log'))
         ret = argparse.Namespace()
 
-        if not self.get_conf(tid, 'lock'):
-            os.environ['BYPASS_LOCK'] = 'yes'
-
         # Perform authentication if needed
         if self.get_conf(tid, 'authenticate'):
             # TODO: Clean this hard fix and find a way to set an authenticator
@@ -631,7 +1378,7 @@ class ActionsMapParser(BaseActionsMapParser):
             raise ValueError("invalid route string '%s'" % string)
 
         key = (m.group(1), m.group(2))
-        if key in self.routes:
+        if key in self._parsers:
             raise ValueError("route '%s' already defined" % string)
 
         return key
@@ -649,19 +1396,81 @@ class Interface(BaseInterface):
             {(method, path): callback}
         - use_websocket -- Serve via WSGI to handle asynchronous responses
         - log_queues -- A LogQueues object or None to retrieve it from
-            registered logging handlers
+            registered logging handlers - which are set to share it
+            between server processes if needed
+        - preload -- True to import all actions modules at start or a
+            list of modules to import as 'namespace.category'
+        - lock_timeout -- The default time period to wait for the lock of
+            a namespace, which can be set for each route with the
+            'lock_timeout' configuration of the action
+        - workers -- The number of threads to process actions in, or 0
+            to process them in the request greenlet
+        - processes -- The number of server processes, which share the
+            sessions, their messages queues and the locks statistics
+            through the cache
+        - max_requests -- The number of requests after which a server
+            process is replaced, 0 to never replace it
+        - worker_timeout -- The time period after which a server process
+            which is blocked is killed, None to never kill it
+        - session_store -- A SessionStore to store the session secrets,
+            in memory - or in the cache with several processes - by
+            default
+        - session_ttl -- The time period after which an unused session
+            expires, None to never expire
+        - session_maxsize -- The maximum number of sessions kept in
+            memory - the least recently used one is removed first - or
+            None for no limit
 
     """
     def __init__(self, actionsmap, routes={}, use_websocket=True,
-                 log_queues=None):
+                 log_queues=None, preload=False, lock_timeout=LOCK_TIMEOUT,
+                 workers=0,
+                 processes=1, max_requests=0, worker_timeout=None,
+                 session_store=None, session_ttl=SESSION_TTL,
+                 session_maxsize=SESSION_MAXSIZE):
         self.use_websocket = use_websocket
+        self.processes = processes
+        self.max_requests = max_requests
+        self.worker_timeout = worker_timeout
+
+        # Import actions modules before serving requests
+        if preload:
+            import_times = actionsmap.preload_functions(
+                None if preload is True else preload)
+            for m, t in import_times.items():
+                logger.debug("module '%s' preloaded in %.3fs", m, t)
+
+        # Use a locale for each request greenlet from preloaded ones
+        m18n.set_context(local())
+        m18n.preload_locales()
 
         # Attempt to retrieve log queues from an APIQueueHandler
+        handler = None
+        shared_queues = log_queues is None and processes > 1
         if log_queues is None:
             handler = log.getHandlersByClass(APIQueueHandler, limit=1)
             if handler:
                 log_queues = handler.queues
 
+        # Share sessions, messages queues and statistics between server
+        # processes
+        stats_path = None
+        if processes > 1:
+            if session_store is None:
+                session_store = FileSessionStore(
+                    pkg.get_cachedir('api/sessions'), session_ttl)
+            stats_path = pkg.get_cachedir('api/stats')
+            for f in os.listdir(stats_path):
+                os.unlink(os.path.join(stats_path, f))
+        if shared_queues:
+            log_queues = SpoolLogQueues(pkg.get_cachedir('api/messages'))
+            log_queues.clear()
+            if handler:
+                handler.queues = log_queues
+
+        if session_store is None:
+            session_store = MemorySessionStore(session_ttl, session_maxsize)
+
         # TODO: Return OK to 'OPTIONS' xhr requests (l173)
         app = Bottle(autojson=True)
 
@@ -672,19 +1481,25 @@ class Interface(BaseInterface):
                 return callback(*args, **kwargs)
             return wrapper
 
-        ## Attempt to retrieve and set locale
+        ## Attempt to retrieve and set locale for the request
         def api18n(callback):
-            try:
-                locale = request.params.pop('locale')
-            except KeyError:
-                locale = m18n.default_locale
-            m18n.set_locale(locale)
-            return callback
+            def wrapper(*args, **kwargs):
+                try:
+                    locale = request.params.pop('locale')
+                except KeyError:
+                    locale = m18n.default_locale
+                m18n.set_locale(locale)
+                return callback(*args, **kwargs)
+            return wrapper
 
         # Install plugins
         app.install(apiheader)
         app.install(api18n)
-        app.install(_ActionsMapPlugin(actionsmap, use_websocket, log_queues))
+        self._plugin = _ActionsMapPlugin(
+            actionsmap, use_websocket, log_queues, lock_timeout,
+            ActionsPool(workers) if workers else None, session_store,
+            stats_path)
+        app.install(self._plugin)
 
         # Append default routes
 #        app.route(['/api', '/api/<category:re:[a-z]+>'], method='GET',
@@ -712,6 +1527,20 @@ class Interface(BaseInterface):
                      host, port, self.use_websocket)
 
         try:
+            if self.processes > 1:
+                handler_class = None
+                if self.use_websocket:
+                    from geventwebsocket.handler import WebSocketHandler
+                    handler_class = WebSocketHandler
+
+                server = PreforkServer(self._app, host, port, self.processes,
+                                       handler_class, self.max_requests,
+                                       self.worker_timeout,
+                                       lambda: spawn(self._sweep_sessions))
+                server.serve_forever()
+                return
+
+            spawn(self._sweep_sessions)
             if self.use_websocket:
                 from gevent.pywsgi import WSGIServer
                 from geventwebsocket.handler import WebSocketHandler
@@ -730,6 +1559,18 @@ class Interface(BaseInterface):
             raise MoulinetteError(errno.EIO, m18n.g('error_see_log'))
 
 
+    ## Private methods
+
+    def _sweep_sessions(self):
+        """Sweep expired sessions periodically"""
+        while True:
+            sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                self._plugin.sweep_sessions()
+            except Exception:
+                logger.exception("unable to sweep expired sessions")
+
+
     ## Routes handlers
 
     def doc(self, category=None):
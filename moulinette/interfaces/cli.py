@@ -3,12 +3,9 @@
 import os
 import sys
 import errno
-import getpass
 import locale
 from argparse import SUPPRESS
 
-import argcomplete
-
 from moulinette.core import MoulinetteError
 from moulinette.interfaces import (
     BaseActionsMapParser, BaseInterface, ExtendedArgumentParser,
@@ -273,6 +270,55 @@ class ActionsMapParser(BaseActionsMapParser):
         """
         return self._subparsers.add_parser(name, help=action_help)
 
+    def filter_actions(self, args, categories):
+        """Filter actions needed to parse arguments
+
+        Look for the category and action names in 'args', skipping
+        global options and their value. All actions are needed for
+        auto-completion, help or if the command can't be resolved.
+
+        """
+        if '_ARGCOMPLETE' in os.environ or \
+                '-h' in args or '--help' in args:
+            return None
+
+        names = []
+        options = self._parser._option_string_actions
+        args_iter = iter(args)
+        for arg in args_iter:
+            if arg == '--':
+                return None
+            elif not arg.startswith('-') or arg == '-':
+                names.append(arg)
+                if len(names) == 2:
+                    break
+            elif names:
+                # Options of the category are not supported
+                return None
+            elif arg.startswith('--') and '=' in arg:
+                if arg.split('=', 1)[0] not in options:
+                    return None
+            else:
+                try:
+                    nargs = options[arg].nargs
+                except KeyError:
+                    return None
+                if nargs is None:
+                    nargs = 1
+                elif not isinstance(nargs, int):
+                    return None
+                # Skip the option values
+                for _i in xrange(nargs):
+                    next(args_iter, None)
+
+        if not names:
+            # Only global arguments are given
+            return []
+        elif len(names) < 2 or names[0] not in categories or \
+                names[1] not in categories[names[0]]:
+            return None
+        return [tuple(names)]
+
     def parse_args(self, args, **kwargs):
         try:
             ret = self._parser.parse_args(args)
@@ -326,7 +372,9 @@ class Interface(BaseInterface):
             raise MoulinetteError(errno.EINVAL, m18n.g('invalid_usage'))
 
         # auto-complete
-        argcomplete.autocomplete(self.actionsmap.parser._parser)
+        if '_ARGCOMPLETE' in os.environ:
+            import argcomplete
+            argcomplete.autocomplete(self.actionsmap.parser._parser)
 
         try:
             ret = self.actionsmap.process(args, timeout=5)
@@ -373,6 +421,7 @@ class Interface(BaseInterface):
 
         """
         if is_password:
+            import getpass
             prompt = lambda m: getpass.getpass(colorize(m18n.g('colon', m),
                                                         color))
         else:
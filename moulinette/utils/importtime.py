@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import atexit
+import __builtin__
+
+
+# Import time report ---------------------------------------------------
+
+"""The environment variable which enables the report at start"""
+ENV_VARIABLE = 'MOULINETTE_IMPORT_TIME'
+
+_original_import = None
+_records = []
+_stack = []
+
+def enable(stream=None):
+    """Record the time spent to import each module
+
+    Wrap the built-in __import__ function to record, for each module
+    which is imported for the first time, the time spent in its own
+    import and the cumulative time - including its nested imports. The
+    report is written to 'stream' - stderr by default - at exit.
+
+    Keyword arguments:
+        - stream -- A file object to write the report to
+
+    """
+    global _original_import
+    if _original_import is not None:
+        return
+    _original_import = __builtin__.__import__
+    __builtin__.__import__ = _timed_import
+    atexit.register(lambda: print_report(stream))
+
+def enable_from_environ():
+    """Enable the report if the environment variable is set"""
+    if os.environ.get(ENV_VARIABLE, '') not in ('', '0'):
+        enable()
+
+def get_records():
+    """Return the list of (name, depth, self, cumulative) recorded in
+    the order the modules were imported"""
+    return [tuple(r) for r in _records if r[3] is not None]
+
+def print_report(stream=None):
+    """Write the recorded import times in microseconds"""
+    if stream is None:
+        stream = sys.stderr
+    stream.write("import time: self [us] | cumulative | imported package\n")
+    for name, depth, self_t, cumul_t in get_records():
+        stream.write("import time: %9d | %10d | %s%s\n" % (
+            self_t * 1e6, cumul_t * 1e6, '  ' * depth, name))
+
+
+# Private functions ----------------------------------------------------
+
+def _resolve(name, globals, level):
+    """Return the full names the module could be imported as"""
+    if level == 0 or not globals or not globals.get('__name__'):
+        return [name]
+    package = globals.get('__package__')
+    if not package:
+        package = globals['__name__']
+        if '__path__' not in globals:
+            package = package.rpartition('.')[0]
+    if level > 1:
+        package = package.rsplit('.', level - 1)[0]
+    if not package:
+        return [name]
+    relative = '%s.%s' % (package, name)
+    # Implicit relative imports are attempted first
+    return [relative] if level > 0 else [relative, name]
+
+def _timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    names = _resolve(name, globals, level) if name else []
+    for n in names:
+        if sys.modules.get(n) is not None:
+            names = []
+            break
+    if not names:
+        # Already imported
+        return _original_import(name, globals, locals, fromlist, level)
+
+    # [name, depth, self, cumulative] with time of nested imports
+    record = [name, len(_stack), 0, None]
+    _records.append(record)
+    _stack.append(record)
+    start = time.time()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _stack.pop()
+        elapsed = time.time() - start
+        for n in names:
+            if sys.modules.get(n) is not None:
+                record[0] = n
+                record[2] += elapsed
+                record[3] = elapsed
+                if _stack:
+                    _stack[-1][2] -= elapsed
+                break
+        else:
+            # The import failed, attribute its own time to the parent
+            _records.remove(record)
+            if _stack:
+                _stack[-1][2] += record[2]
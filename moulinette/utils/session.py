@@ -0,0 +1,217 @@
+import os
+import re
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# Session stores -------------------------------------------------------
+
+_session_id_re = re.compile(r'^[A-Za-z0-9]+$')
+
+def is_valid_session_id(sid):
+    """Return True if a session id can be safely used as a file name"""
+    return bool(sid) and _session_id_re.match(sid) is not None
+
+
+class SessionStore(object):
+    """Base class for a store of sessions
+
+    Map session ids to values which expire once they have not been
+    accessed for 'ttl' seconds. An expired session is removed when it is
+    accessed or by sweep, which is intended to be called periodically.
+    Stores can be used as a dict, except that checking if a session is
+    in the store doesn't count as an access.
+
+    Keyword arguments:
+        - ttl -- The time period after which an unused session expires,
+            None to never expire
+
+    """
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+
+    def get(self, sid):
+        """Return the value of a session and refresh its access time
+
+        Raise a KeyError if the session doesn't exist or has expired.
+
+        """
+        raise NotImplementedError("derived class '%s' must override this method" % \
+                                      self.__class__.__name__)
+
+    def set(self, sid, value):
+        """Set the value of a session"""
+        raise NotImplementedError("derived class '%s' must override this method" % \
+                                      self.__class__.__name__)
+
+    def delete(self, sid):
+        """Delete a session, raise a KeyError if it doesn't exist"""
+        raise NotImplementedError("derived class '%s' must override this method" % \
+                                      self.__class__.__name__)
+
+    def has(self, sid):
+        """Return True if a session exists and has not expired"""
+        raise NotImplementedError("derived class '%s' must override this method" % \
+                                      self.__class__.__name__)
+
+    def sweep(self):
+        """Remove expired sessions and return their ids"""
+        raise NotImplementedError("derived class '%s' must override this method" % \
+                                      self.__class__.__name__)
+
+    def _is_expired(self, atime, now=None):
+        if self.ttl is None:
+            return False
+        return (now or time.time()) - atime > self.ttl
+
+    def __getitem__(self, sid):
+        return self.get(sid)
+
+    def __setitem__(self, sid, value):
+        self.set(sid, value)
+
+    def __delitem__(self, sid):
+        self.delete(sid)
+
+    def __contains__(self, sid):
+        return self.has(sid)
+
+
+class MemorySessionStore(SessionStore):
+    """Store of sessions in memory
+
+    Sessions are kept in the order of their last access, so that the
+    least recently used one is evicted when the store is full and that
+    expired sessions are found without looking at all of them. The store
+    can be shared between threads.
+
+    Keyword arguments:
+        - ttl -- The time period after which an unused session expires,
+            None to never expire
+        - maxsize -- The maximum number of sessions, None for no limit
+
+    """
+    def __init__(self, ttl=None, maxsize=None):
+        super(MemorySessionStore, self).__init__(ttl)
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()  # {sid: (value, access time)}
+        self._evicted = []
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            value, atime = self._sessions.pop(sid)
+            now = time.time()
+            if self._is_expired(atime, now):
+                raise KeyError(sid)
+            self._sessions[sid] = (value, now)
+            return value
+
+    def set(self, sid, value):
+        with self._lock:
+            self._sessions.pop(sid, None)
+            self._sessions[sid] = (value, time.time())
+            while self.maxsize is not None and \
+                    len(self._sessions) > self.maxsize:
+                self._evicted.append(self._sessions.popitem(last=False)[0])
+
+    def delete(self, sid):
+        with self._lock:
+            del self._sessions[sid]
+
+    def has(self, sid):
+        with self._lock:
+            try:
+                return not self._is_expired(self._sessions[sid][1])
+            except KeyError:
+                return False
+
+    def sweep(self):
+        with self._lock:
+            expired, self._evicted = self._evicted, []
+            now = time.time()
+            for sid, (value, atime) in self._sessions.items():
+                if not self._is_expired(atime, now):
+                    # Next ones have been accessed later
+                    break
+                expired.append(sid)
+                del self._sessions[sid]
+            return expired
+
+
+class FileSessionStore(SessionStore):
+    """Store of sessions in files
+
+    The value of a session is stored in a file of the given directory,
+    which is only readable by its owner and whose modification time is
+    the last access time. The store can be shared between processes.
+
+    Keyword arguments:
+        - path -- The directory where sessions are stored
+        - ttl -- The time period after which an unused session expires,
+            None to never expire
+
+    """
+    def __init__(self, path, ttl=None):
+        super(FileSessionStore, self).__init__(ttl)
+        self.path = path
+
+    def get(self, sid):
+        path = self._get_path(sid)
+        try:
+            if self._is_expired(os.stat(path).st_mtime):
+                os.unlink(path)
+                raise KeyError(sid)
+            with open(path) as f:
+                value = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            raise KeyError(sid)
+        return value
+
+    def set(self, sid, value):
+        path = self._get_path(sid)
+        fd, tmp_file = tempfile.mkstemp(prefix='.', dir=self.path)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(value)
+            os.rename(tmp_file, path)
+        except:
+            os.unlink(tmp_file)
+            raise
+
+    def delete(self, sid):
+        try:
+            os.unlink(self._get_path(sid))
+        except OSError:
+            raise KeyError(sid)
+
+    def has(self, sid):
+        try:
+            return not self._is_expired(os.stat(self._get_path(sid)).st_mtime)
+        except (KeyError, OSError):
+            return False
+
+    def sweep(self):
+        expired = []
+        if self.ttl is None:
+            return expired
+        now = time.time()
+        for sid in os.listdir(self.path):
+            path = os.path.join(self.path, sid)
+            try:
+                if self._is_expired(os.stat(path).st_mtime, now):
+                    os.unlink(path)
+                    if not sid.startswith('.'):
+                        expired.append(sid)
+            except OSError:
+                # Removed meanwhile
+                pass
+        return expired
+
+    def _get_path(self, sid):
+        if not is_valid_session_id(sid):
+            raise KeyError(sid)
+        return os.path.join(self.path, sid)
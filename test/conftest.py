@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Test the moulinette of the source tree
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+
+@pytest.fixture
+def pkg(tmpdir, monkeypatch):
+    """Return a Package running from a temporary source tree"""
+    from moulinette.core import Package
+
+    for d in ['bin', 'data/actionsmap', 'lib', 'locales', 'cache']:
+        tmpdir.ensure(d, dir=True)
+    monkeypatch.setattr(sys, 'argv', [str(tmpdir.join('bin', 'moulinette'))])
+    return Package(_from_source=True)
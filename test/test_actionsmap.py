@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import __builtin__
+
+import pytest
+import yaml
+
+from moulinette import actionsmap
+from moulinette.actionsmap import (
+    ActionsMap, ActionsMapBundle, JSONLoader, YAMLLoader,
+    compile_actionsmap, get_source_key,
+)
+
+
+ACTIONSMAP = """
+_global:
+    configuration:
+        authenticate: false
+        lock: false
+    arguments:
+        -v:
+            full: --version
+            help: Display version
+            action: version
+            version: "1.0"
+user:
+    category_help: Manage users
+    actions:
+        create:
+            action_help: Create a user
+            api: POST /users
+            configuration:
+                authenticate: all
+            arguments:
+                username:
+                    help: The username
+                    extra:
+                        pattern:
+                            - '^[a-z0-9_]+$'
+                            - pattern_username
+                -f:
+                    full: --firstname
+                    help: "Prénom"
+                    extra:
+                        required: true
+                --groups:
+                    nargs: '*'
+                    default: []
+                -l:
+                    full: --limit
+                    type: int
+                    default: 10
+                --force:
+                    action: store_true
+        list:
+            action_help: List users
+            api: [GET /users, GET /users/list]
+domain:
+    category_help: Manage domains
+    actions:
+        list:
+            action_help: List domains
+            api: GET /domains
+            arguments:
+                --filter:
+                    help: A filter
+                    nargs: '?'
+"""
+
+
+@pytest.fixture
+def yaml_loader(monkeypatch):
+    """Return a function to load YAML with or without libyaml"""
+    def load(source, use_libyaml):
+        monkeypatch.setattr(actionsmap, '_yaml_loader', None)
+        if not use_libyaml:
+            monkeypatch.delattr(yaml, 'CLoader', raising=False)
+        try:
+            return YAMLLoader.load(source)
+        finally:
+            monkeypatch.undo()
+    return load
+
+
+def test_loaders_parity(yaml_loader):
+    if not hasattr(yaml, 'CLoader'):
+        pytest.skip("libyaml is not available")
+    key = get_source_key(ACTIONSMAP)
+
+    c_loaded = yaml_loader(ACTIONSMAP, True)
+    py_loaded = yaml_loader(ACTIONSMAP, False)
+    json_loaded = JSONLoader.load(json.dumps(py_loaded))
+
+    assert c_loaded == py_loaded == json_loaded
+    assert list(c_loaded) == list(py_loaded) == list(json_loaded)
+    bundles = [compile_actionsmap('test', loaded, key)
+               for loaded in (c_loaded, py_loaded, json_loaded)]
+    assert bundles[0] == bundles[1] == bundles[2]
+
+
+def test_outdated_provided_bundle(pkg, monkeypatch):
+    monkeypatch.setattr(__builtin__, 'pkg', pkg, raising=False)
+    path = os.path.join(pkg.datadir, 'actionsmap', 'test.%s')
+
+    def write(ext, data):
+        with open(path % ext, 'w') as f:
+            f.write(data)
+
+    # Only the compiled actions map is provided
+    write('bundle', compile_actionsmap(
+        'test', YAMLLoader.load(ACTIONSMAP), get_source_key(ACTIONSMAP)))
+    assert isinstance(ActionsMap._load_provided('test'),
+                      ActionsMapBundle)
+
+    # It is compiled from the actions map file
+    write('yml', ACTIONSMAP)
+    assert isinstance(ActionsMap._load_provided('test'),
+                      ActionsMapBundle)
+
+    # The actions map file has changed since
+    write('yml', ACTIONSMAP.replace('List domains', 'List all domains'))
+    assert ActionsMap._load_provided('test') is None
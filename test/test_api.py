@@ -0,0 +1,120 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib2
+
+import pytest
+
+from moulinette.interfaces.api import ActionsPool
+
+
+ACTIONSMAP = """
+_global:
+    configuration:
+        authenticate: false
+        lock: false
+test:
+    actions:
+        pid:
+            api: GET /pid
+"""
+
+LIBRARY = """
+import os
+
+def test_pid():
+    return {'pid': os.getpid()}
+"""
+
+SERVER = """
+import sys
+
+import moulinette
+
+moulinette.init(_from_source=True)
+moulinette.api(['test'], host='127.0.0.1', port=int(sys.argv[1]),
+               use_websocket=False, workers=int(sys.argv[2]),
+               processes=int(sys.argv[3]))
+"""
+
+
+def _get_free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+@pytest.fixture
+def server(pkg):
+    """Return a function which runs a test API server from the package
+    and returns its URL"""
+    with open(os.path.join(pkg.datadir, 'actionsmap', 'test.yml'), 'w') as f:
+        f.write(ACTIONSMAP)
+    os.makedirs(os.path.join(pkg.libdir, 'test', 'locales'))
+    with open(os.path.join(pkg.libdir, 'test', '__init__.py'), 'w') as f:
+        f.write('')
+    with open(os.path.join(pkg.libdir, 'test', 'test.py'), 'w') as f:
+        f.write(LIBRARY)
+    for localedir in [pkg.localedir,
+                      os.path.join(pkg.libdir, 'test', 'locales')]:
+        with open(os.path.join(localedir, 'en.json'), 'w') as f:
+            f.write('{}')
+    script = os.path.join(os.path.dirname(sys.argv[0]), 'server.py')
+    with open(script, 'w') as f:
+        f.write(SERVER)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.abspath(os.path.join(
+        os.path.dirname(__file__), '..'))
+    processes = []
+
+    def run(workers, processes_count):
+        port = _get_free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, script, str(port), str(workers),
+             str(processes_count)], env=env))
+        return 'http://127.0.0.1:%d' % port
+
+    yield run
+    for p in processes:
+        p.terminate()
+        p.wait()
+
+
+def _get(url, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return json.loads(urllib2.urlopen(url, timeout=timeout).read())
+        except (urllib2.URLError, socket.error):
+            if time.time() > deadline:
+                raise
+            time.sleep(.1)
+
+
+def test_process_action_with_workers_and_processes(server):
+    url = server(workers=2, processes_count=2)
+    pids = set()
+    for i in range(10):
+        pids.add(_get(url + '/pid')['pid'])
+    assert pids
+
+
+def test_actions_pool_after_fork():
+    import gevent
+
+    pool = ActionsPool(1)
+    assert pool.pool.spawn(lambda: 1).get(timeout=3) == 1
+    pid = os.fork()
+    if pid == 0:
+        gevent.reinit()
+        try:
+            os._exit(pool.pool.spawn(lambda: 0).get(timeout=3))
+        except BaseException:
+            os._exit(1)
+    assert os.waitpid(pid, 0)[1] == 0
@@ -0,0 +1,150 @@
+import __builtin__
+import os
+import sys
+import types
+
+import pytest
+
+from moulinette.core import Moulinette18n, MoulinetteError
+from moulinette import authenticators
+from moulinette.authenticators import (
+    BaseAuthenticator, encrypt_session, decrypt_session,
+)
+
+
+SESSION_ID = 'abcdef0123456789'
+SESSION_HASH = 'a session hash which is random'
+
+
+class Authenticator(BaseAuthenticator):
+    vendor = 'test'
+
+    def __init__(self, name='default'):
+        super(Authenticator, self).__init__(name)
+        self.passwords = []
+
+    @property
+    def is_authenticated(self):
+        return False
+
+    def authenticate(self, password=None):
+        self.passwords.append(password)
+
+
+@pytest.fixture
+def auth(pkg, monkeypatch):
+    """Return an Authenticator which stores sessions in the package"""
+    with open(os.path.join(pkg.localedir, 'en.json'), 'w') as f:
+        f.write('{}')
+    monkeypatch.setattr(__builtin__, 'pkg', pkg, raising=False)
+    monkeypatch.setattr(__builtin__, 'm18n', Moulinette18n(pkg),
+                        raising=False)
+    monkeypatch.setattr(authenticators, '_sessions_cache', {})
+    return Authenticator()
+
+
+@pytest.mark.parametrize('password', ['', 'secret', 'x' * 100,
+                                      u'\xe9t\xe9'.encode('utf-8')])
+def test_session_round_trip(password):
+    data = encrypt_session(SESSION_HASH, password)
+    assert password not in data or not password
+    assert decrypt_session(SESSION_HASH, data) == password
+    # A new salt is used for each encryption
+    assert encrypt_session(SESSION_HASH, password) != data
+
+
+def test_session_unicode_password():
+    data = encrypt_session(SESSION_HASH, u'\xe9t\xe9')
+    assert decrypt_session(SESSION_HASH, data) == \
+        u'\xe9t\xe9'.encode('utf-8')
+
+
+def test_session_rejected():
+    data = encrypt_session(SESSION_HASH, 'secret')
+    assert decrypt_session('another hash', data) is None
+    # Tampered tag or ciphertext
+    tampered = data[:-1] + chr(ord(data[-1]) ^ 1)
+    assert decrypt_session(SESSION_HASH, tampered) is None
+    tampered = data[:20] + chr(ord(data[20]) ^ 1) + data[21:]
+    assert decrypt_session(SESSION_HASH, tampered) is None
+    # Truncated blob or wrong magic string
+    assert decrypt_session(SESSION_HASH, data[:-1]) is None
+    assert decrypt_session(SESSION_HASH, data[:51]) is None
+    assert decrypt_session(SESSION_HASH, '') is None
+    assert decrypt_session(SESSION_HASH, 'XXXX' + data[4:]) is None
+
+
+def test_store_and_retrieve_session(auth):
+    auth('secret', token=(SESSION_ID, SESSION_HASH))
+    assert os.path.isfile(auth._get_sessionfile(SESSION_ID))
+    assert Authenticator()(token=(SESSION_ID, SESSION_HASH)).passwords == \
+        ['secret']
+
+    with pytest.raises(MoulinetteError):
+        Authenticator()(token=(SESSION_ID, 'another hash'))
+    with pytest.raises(MoulinetteError):
+        Authenticator()(token=('unknown', SESSION_HASH))
+
+
+def test_migrate_session(auth, monkeypatch):
+    class Decrypted(object):
+        def __init__(self, ok, data):
+            self.ok = ok
+            self.data = data
+            self.status = 'decryption ok' if ok else 'decryption failed'
+
+    class GPG(object):
+        encoding = None
+
+        def decrypt(self, message, passphrase=None):
+            if message == 'encrypted' and passphrase == SESSION_HASH:
+                return Decrypted(True, 'secret')
+            return Decrypted(False, '')
+
+    gnupg = types.ModuleType('gnupg')
+    gnupg.GPG = GPG
+    monkeypatch.setitem(sys.modules, 'gnupg', gnupg)
+
+    with auth._open_sessionfile(SESSION_ID, 'w', 'asc') as f:
+        f.write('encrypted')
+    with pytest.raises(MoulinetteError):
+        Authenticator()(token=(SESSION_ID, 'another hash'))
+    assert os.path.isfile(auth._get_sessionfile(SESSION_ID, 'asc'))
+
+    assert auth(token=(SESSION_ID, SESSION_HASH)).passwords == ['secret']
+    assert not os.path.exists(auth._get_sessionfile(SESSION_ID, 'asc'))
+    with auth._open_sessionfile(SESSION_ID, 'rb') as f:
+        assert decrypt_session(SESSION_HASH, f.read()) == 'secret'
+
+    # The session is retrieved from the new file without GnuPG
+    monkeypatch.delitem(sys.modules, 'gnupg')
+    monkeypatch.setattr(authenticators, '_sessions_cache', {})
+    assert Authenticator()(token=(SESSION_ID, SESSION_HASH)).passwords == \
+        ['secret']
+
+
+def test_session_cache_dropped_on_change(auth):
+    auth('secret', token=(SESSION_ID, SESSION_HASH))
+    path = auth._get_sessionfile(SESSION_ID)
+    assert authenticators._sessions_cache[path][2] == 'secret'
+
+    # The cached password is used while the file is unchanged
+    with open(path, 'wb') as f:
+        f.write(encrypt_session(SESSION_HASH, 'changed'))
+    mtime = authenticators._sessions_cache[path][0]
+    os.utime(path, (mtime, mtime))
+    assert Authenticator()(token=(SESSION_ID, SESSION_HASH)).passwords == \
+        ['secret']
+
+    # It is dropped once the file is modified
+    os.utime(path, (mtime + 10, mtime + 10))
+    assert Authenticator()(token=(SESSION_ID, SESSION_HASH)).passwords == \
+        ['changed']
+    assert authenticators._sessions_cache[path][2] == 'changed'
+
+    with open(path, 'wb') as f:
+        f.write('invalid')
+    os.utime(path, (mtime + 20, mtime + 20))
+    with pytest.raises(MoulinetteError):
+        Authenticator()(token=(SESSION_ID, SESSION_HASH))
+    assert path not in authenticators._sessions_cache
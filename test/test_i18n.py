@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from moulinette.core import Moulinette18n
+
+
+TRANSLATIONS = {
+    'en': {'logged_in': "Logged in", 'hello': "Hello {name}",
+           'only_en': "Only in english"},
+    'fr': {'logged_in': u"Connecté", 'hello': u"Bonjour {name}"},
+}
+KEYS = ['logged_in', 'hello', 'only_en', 'unknown_key']
+
+
+def _write_locales(pkg):
+    for locale, translations in TRANSLATIONS.items():
+        with open(os.path.join(pkg.localedir, '%s.json' % locale), 'w') as f:
+            json.dump(translations, f)
+
+
+def _translate_all(pkg):
+    m = Moulinette18n(pkg)
+    result = {}
+    for locale in ['en', 'fr', 'de']:
+        m.set_locale(locale)
+        result[locale] = [m.g(k, name='foo') for k in KEYS]
+    return m, result
+
+
+def test_bundle_translations(pkg):
+    _write_locales(pkg)
+    m, expected = _translate_all(pkg)
+    assert m._bundle is None
+    assert expected['fr'][0] == u"Connecté".encode('utf-8')
+
+    m.build_bundle()
+    assert os.path.isfile(os.path.join(pkg.cachedir, 'locales',
+                                       'catalog.bundle'))
+    m, result = _translate_all(pkg)
+    assert m._bundle is not None
+    assert result == expected
+
+
+def test_unavailable_locales(pkg):
+    _write_locales(pkg)
+    m = Moulinette18n(pkg)
+    m.preload_locales()
+    for i in range(100):
+        m.set_locale('unknown%d' % i)
+        assert m.g('logged_in') == "Logged in"
+        assert m.g('unknown_key') == 'unknown_key'
+    assert sorted(m._global._catalogs) == ['en', 'fr']
+    assert m._global.get_stats().keys() == ['en']